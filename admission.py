@@ -0,0 +1,120 @@
+import time
+from typing import Optional, Tuple
+
+
+def parse_rate(text):
+    """'10/60' -> (10, 60.0): 10 usos que se recuperan en 60 segundos. Vacío o '0' -> None (sin límite)."""
+    text = (text or "").strip()
+    if not text or text == "0":
+        return None
+    uses, _, seconds = text.partition("/")
+    uses, seconds = int(uses), float(seconds or 60)
+    if uses <= 0 or seconds <= 0:
+        raise ValueError(f"Límite no válido: {text!r} (se espera usos/segundos, p. ej. 10/60)")
+    return uses, seconds
+
+
+class RateLimiter:
+    """Un token bucket por clave: hasta `uses` seguidos, que se recuperan a lo largo de `seconds`.
+
+    Los cubos solo existen mientras les faltan tokens; uno lleno equivale a uno
+    nuevo, así que se descartan al crecer el diccionario.
+    """
+    def __init__(self, uses, seconds, max_keys=10000, clock=time.monotonic):
+        self.capacity = uses
+        self.rate = uses / seconds
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = {}  # clave -> (tokens, instante de la última actualización)
+
+    def tokens(self, key, now=None):
+        now = self.clock() if now is None else now
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key, cost=1, now=None):
+        """Segundos hasta que haya `cost` tokens (0 si ya los hay)."""
+        if cost > self.capacity:
+            return float("inf")
+        missing = cost - self.tokens(key, now)
+        return max(0.0, missing / self.rate)
+
+    def take(self, key, cost=1, now=None):
+        now = self.clock() if now is None else now
+        self._buckets[key] = (self.tokens(key, now) - cost, now)
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+
+    def _prune(self, now):
+        for key in [key for key in self._buckets if self.tokens(key, now) >= self.capacity]:
+            del self._buckets[key]
+
+
+class AdmissionControl:
+    """Decide si se acepta un /play antes de hacer ningún trabajo.
+
+    Cada petición gasta un token de su usuario y otro de su servidor, y cada
+    extracción de yt_dlp que necesite, uno más de sus cubos de extracciones.
+    Solo se cobra si todos los cubos alcanzan; si no, se rechaza entera y se
+    dice cuánto esperar. Un límite None no se comprueba.
+    """
+    def __init__(self, user_requests=None, guild_requests=None, user_extractions=None, guild_extractions=None,
+                 clock=time.monotonic):
+        self.clock = clock
+        self.limiters = {
+            (scope, kind): RateLimiter(*rate, clock=clock)
+            for (scope, kind), rate in {
+                ("user", "requests"): user_requests,
+                ("guild", "requests"): guild_requests,
+                ("user", "extractions"): user_extractions,
+                ("guild", "extractions"): guild_extractions,
+            }.items()
+            if rate is not None
+        }
+        self.rejections = {}  # (ámbito, tipo) -> rechazos, para las métricas
+
+    def reject(self, scope, kind):
+        """Cuenta un rechazo (también los que no dependen de los cubos, como la cola llena)."""
+        self.rejections[(scope, kind)] = self.rejections.get((scope, kind), 0) + 1
+
+    def admit(self, guild, user, extractions=0) -> Optional[Tuple[str, str, float]]:
+        """Cobra la petición y devuelve None, o (ámbito, tipo, segundos de espera) si se rechaza."""
+        now = self.clock()
+        costs = {"requests": 1, "extractions": extractions}
+        keys = {"user": user, "guild": guild}
+        charges = [
+            (limiter, keys[scope], costs[kind], scope, kind)
+            for (scope, kind), limiter in self.limiters.items()
+            if costs[kind]
+        ]
+        for limiter, key, cost, scope, kind in charges:
+            wait = limiter.retry_after(key, cost, now)
+            if wait > 0:
+                self.reject(scope, kind)
+                return scope, kind, wait
+        for limiter, key, cost, _, _ in charges:
+            limiter.take(key, cost, now)
+        return None
+
+    def take_extractions(self, guild, user, wanted):
+        """Cobra hasta `wanted` extracciones más y devuelve cuántas caben ahora.
+
+        Para lo que trae muchas extracciones de una vez (una playlist en modo
+        resolve): en lugar de rechazarla entera, se toma solo lo que alcanza.
+        """
+        now = self.clock()
+        keys = {"user": user, "guild": guild}
+        granted = wanted
+        limiting = None
+        for (scope, kind), limiter in self.limiters.items():
+            if kind != "extractions":
+                continue
+            available = max(0, int(limiter.tokens(keys[scope], now)))
+            if available < granted:
+                granted, limiting = available, scope
+        if limiting is not None:
+            self.reject(limiting, "extractions")
+        for (scope, kind), limiter in self.limiters.items():
+            if kind == "extractions" and granted:
+                limiter.take(keys[scope], granted, now)
+        return granted
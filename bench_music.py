@@ -0,0 +1,440 @@
+"""Benchmarks de MusicQueue y de la carga de playlists, sin conexión.
+
+Usa un yt_dlp falso (no hace falta red ni tener yt_dlp instalado) y mide
+add, pop, show, shuffle, el añadido en modo shuffle y /remove con colas de
+distintos tamaños, además de una carga simulada de playlist por /play.
+
+Uso:
+    python bench_music.py                      # 100, 10k y 100k canciones
+    python bench_music.py --sizes 100 1000 --output antes.json
+    python bench_music.py --compare antes.json # compara con una ejecución anterior
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from datetime import datetime
+
+
+class StubYoutubeDL:
+    """Sustituto de yt_dlp.YoutubeDL con latencia configurable."""
+    latency = 0.0  # Segundos por extract_info
+    playlist_size = 1000
+    calls = 0
+    _lock = threading.Lock()
+
+    def __init__(self, opts=None):
+        self.opts = opts or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, url, download=False):
+        with StubYoutubeDL._lock:
+            StubYoutubeDL.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if "list=" in url:
+            size = min(self.playlist_size, self.opts.get('playlistend') or self.playlist_size)
+            return {
+                '_type': 'playlist',
+                'entries': [
+                    {'_type': 'url', 'id': f"v{i:010d}", 'title': f"Canción {i}", 'url': f"https://www.youtube.com/watch?v=v{i:010d}"}
+                    for i in range(size)
+                ],
+            }
+        if url.startswith("ytsearch:"):
+            video_id = f"s{abs(hash(url)) % 10**10:010d}"
+            return {'entries': [{'_type': 'url', 'id': video_id, 'title': url[9:], 'url': f"https://www.youtube.com/watch?v={video_id}"}]}
+        video_id = url.rsplit("=", 1)[-1]
+        return {
+            'id': video_id,
+            'title': f"Vídeo {video_id}",
+            'duration': 200,
+            'acodec': 'opus',
+            'webpage_url': url,
+            'url': f"https://rr1---sn.googlevideo.com/videoplayback?expire={int(time.time()) + 21600}&id={video_id}",
+        }
+
+    def prepare_filename(self, info):
+        return f"{info['id']}.webm"
+
+
+def install_stub_yt_dlp():
+    """Registra el yt_dlp falso antes de importar commands_music."""
+    stub = types.ModuleType("yt_dlp")
+    stub.YoutubeDL = StubYoutubeDL
+    sys.modules["yt_dlp"] = stub
+
+
+# --- Sustitutos mínimos de Discord para recorrer /play de principio a fin ---
+
+class FakeSource:
+    def __init__(self, url):
+        self.url = url
+
+    def cleanup(self):
+        pass
+
+
+class FakeVoiceClient:
+    def __init__(self, loop):
+        self.loop = loop
+        self.source = None
+        self.after = None
+        self.connected = True
+        self.played = []  # (instante, url)
+
+    def is_connected(self):
+        return self.connected
+
+    def is_playing(self):
+        return self.source is not None
+
+    def is_paused(self):
+        return False
+
+    def play(self, source, after=None):
+        self.source, self.after = source, after
+        self.played.append((time.perf_counter(), source.url))
+
+    def stop(self):
+        after, self.source, self.after = self.after, None, None
+        if after:
+            after(None)
+
+    async def disconnect(self, force=False):
+        self.connected = False
+        self.source = None
+
+
+class FakeMessage:
+    def __init__(self):
+        self.edits = 0
+        self.content = None
+
+    async def edit(self, content=None, **kwargs):
+        self.edits += 1
+        self.content = content
+
+
+class FakeResponse:
+    def __init__(self, message):
+        self.message = message
+
+    async def send_message(self, content=None, **kwargs):
+        self.message.content = content
+
+
+class FakeInteraction:
+    def __init__(self, guild_id, user_id, voice_client):
+        channel = types.SimpleNamespace(connect=self._connect)
+        self.guild = types.SimpleNamespace(id=guild_id, voice_client=voice_client)
+        self.user = types.SimpleNamespace(id=user_id, name=f"usuario{user_id}", voice=types.SimpleNamespace(channel=channel))
+        self.message = FakeMessage()
+        self.response = FakeResponse(self.message)
+        self._voice_client = voice_client
+
+    async def _connect(self):
+        self.guild.voice_client = self._voice_client
+        return self._voice_client
+
+    async def original_response(self):
+        return self.message
+
+
+class FakeCommand:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def autocomplete(self, name):
+        return lambda func: func
+
+
+class FakeTree:
+    def __init__(self):
+        self.commands = {}
+
+    def command(self, name=None, description=None, **kwargs):
+        def decorator(func):
+            command = FakeCommand(func)
+            self.commands[name or func.__name__] = command
+            return command
+        return decorator
+
+
+class FakeBot:
+    def __init__(self):
+        self.tree = FakeTree()
+        self.user = types.SimpleNamespace(id=0)
+
+    def add_listener(self, func, name=None):
+        pass
+
+    def is_closed(self):
+        return False
+
+
+# --- Medición ---
+
+def summarize(name, size, latencies_ns, elapsed, peak_bytes):
+    latencies_ns.sort()
+    ops = len(latencies_ns)
+    return {
+        'benchmark': name,
+        'size': size,
+        'ops': ops,
+        'ops_per_sec': ops / elapsed if elapsed else None,
+        'p50_us': latencies_ns[ops // 2] / 1000 if ops else None,
+        'p99_us': latencies_ns[min(ops - 1, int(ops * 0.99))] / 1000 if ops else None,
+        'peak_memory_bytes': peak_bytes,
+    }
+
+
+def timed(ops):
+    """Ejecuta cada operación midiendo su latencia; devuelve (latencias_ns, segundos)."""
+    latencies = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for op in ops:
+        t0 = clock()
+        op()
+        latencies.append(clock() - t0)
+    return latencies, (clock() - start) / 1e9
+
+
+def filled_queue(commands_music, size, seed=0):
+    queue = commands_music.MusicQueue(seed=seed)
+    for i in range(size):
+        queue.add(commands_music.Song(f"Canción {i}", f"v{i:010d}", "bench"))
+    return queue
+
+
+def run_case(commands_music, name, size, build, make_ops):
+    """Mide un caso dos veces: una para tiempos y otra, con tracemalloc, para la memoria."""
+    state = build()
+    latencies, elapsed = timed(make_ops(state))
+
+    state = build()
+    ops = make_ops(state)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for op in ops:
+        op()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return summarize(name, size, latencies, elapsed, peak)
+
+
+def queue_benchmarks(commands_music, size):
+    rng = random.Random(size)
+    loop = asyncio.new_event_loop()
+    results = []
+
+    def song(i):
+        return commands_music.Song(f"Canción {i}", f"v{i:010d}", "bench")
+
+    results.append(run_case(
+        commands_music, 'add', size,
+        lambda: commands_music.MusicQueue(seed=0),
+        lambda q: [lambda i=i: q.add(song(i)) for i in range(size)],
+    ))
+
+    def shuffled_queue():
+        q = commands_music.MusicQueue(seed=0)
+        q.shuffle_active = True
+        return q
+
+    results.append(run_case(
+        commands_music, 'add_shuffle_mode', size,
+        shuffled_queue,
+        lambda q: [lambda i=i: q.add(song(i)) for i in range(size)],
+    ))
+
+    results.append(run_case(
+        commands_music, 'pop', size,
+        lambda: filled_queue(commands_music, size),
+        lambda q: [q.pop for _ in range(size)],
+    ))
+
+    pages = [rng.randrange(max(size - 10, 1)) for _ in range(1000)]
+    results.append(run_case(
+        commands_music, 'show_page', size,
+        lambda: filled_queue(commands_music, size),
+        lambda q: [lambda s=s: q.show(s, s + 10) for s in pages],
+    ))
+
+    removals = min(size // 2, 1000)
+    results.append(run_case(
+        commands_music, 'remove', size,
+        lambda: filled_queue(commands_music, size),
+        lambda q: [lambda: q.remove(rng.randint(1, len(q.play_order))) for _ in range(removals)],
+    ))
+
+    shuffles = max(1, min(20, 100_000 // size))
+    results.append(run_case(
+        commands_music, 'shuffle', size,
+        lambda: filled_queue(commands_music, size),
+        lambda q: [lambda: loop.run_until_complete(q.shuffle()) for _ in range(shuffles)],
+    ))
+
+    loop.close()
+    return results
+
+
+def song_memory(commands_music, size):
+    """Bytes por canción en cola: el dict de antes (con la URL de streaming) frente a Song."""
+    # Las URLs de googlevideo rondan los 1000 caracteres
+    stream_url = f"https://rr1---sn-h5q7dnee.googlevideo.com/videoplayback?expire={int(time.time()) + 21600}&" + "p" * 900
+
+    def legacy(i):
+        return {
+            'title': f"Canción {i}",
+            'url': f"{stream_url}&id={i}",
+            'video_id': f"v{i:010d}",
+            'added_by': f"usuario{i % 5}",  # Cada /play trae su propio str con el nombre
+            'downloaded': True,
+            'id': i,
+            'shuffle_status': "▶️",
+        }
+
+    def compact(i):
+        song = commands_music.Song(f"Canción {i}", f"v{i:010d}", f"usuario{i % 5}")
+        song.id = i
+        return song
+
+    result = {'benchmark': 'song_memory', 'size': size}
+    for name, make in (('dict', legacy), ('slots', compact)):
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        records = [make(i) for i in range(size)]
+        used = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+        del records
+        result[f'bytes_per_song_{name}'] = used / size
+    return result
+
+
+async def ingest_playlist(commands_music, entries, latency, mode):
+    """Recorre /play con una playlist de `entries` canciones y mide cuándo queda en cola.
+
+    `mode` es el MUSIC_PLAYLIST_MODE a medir: 'jit' o 'resolve'.
+    """
+    commands_music.PLAYLIST_MODE = mode
+    # Se mide la playlist entera, sin el límite de MUSIC_MAX_PLAYLIST ni el de extracciones
+    commands_music.MAX_PLAYLIST = 0
+    commands_music.URL_OPTIONS = commands_music.YTDL_OPTIONS
+    commands_music.admission = commands_music.AdmissionControl()
+    StubYoutubeDL.latency = latency
+    StubYoutubeDL.playlist_size = entries
+    StubYoutubeDL.calls = 0
+    commands_music.stream_cache.entries.clear()
+
+    async def fake_create_source(url, codec=None, before_options=''):
+        return FakeSource(url)
+
+    commands_music.create_source = fake_create_source
+
+    # Para esperar a la última edición, que sale de su propia tarea
+    progress_messages = []
+    original_progress = commands_music.ProgressMessage
+
+    class TrackedProgress(original_progress):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            progress_messages.append(self)
+
+    commands_music.ProgressMessage = TrackedProgress
+    bot = FakeBot()
+    commands_music.setup_music_commands(bot)
+    voice_client = FakeVoiceClient(asyncio.get_running_loop())
+    interaction = FakeInteraction(guild_id=1, user_id=1, voice_client=voice_client)
+
+    start = time.perf_counter()
+    await bot.tree.commands['play'].callback(interaction, "https://www.youtube.com/playlist?list=BENCH")
+    queued = time.perf_counter() - start
+    first_play = voice_client.played[0][0] - start if voice_client.played else None
+    await asyncio.gather(*(progress._task for progress in progress_messages if progress._task))
+    commands_music.ProgressMessage = original_progress
+
+    voice_client.connected = False
+    await asyncio.sleep(0)
+    return {
+        'benchmark': f'playlist_ingestion_{mode}',
+        'size': entries,
+        'extraction_latency_ms': latency * 1000,
+        'time_to_first_play_s': first_play,
+        'time_to_queued_s': queued,
+        'extract_info_calls': StubYoutubeDL.calls,
+        'progress_edits': interaction.message.edits,
+    }
+
+
+def compare(previous_path, results):
+    with open(previous_path, "r") as f:
+        previous = {(r['benchmark'], r['size']): r for r in json.load(f)['results']}
+    print(f"\nComparación con {previous_path} (ops/s, >1 es más rápido):")
+    for r in results:
+        old = previous.get((r['benchmark'], r['size']))
+        if old and old.get('ops_per_sec') and r.get('ops_per_sec'):
+            print(f"  {r['benchmark']:<18} {r['size']:>7}  x{r['ops_per_sec'] / old['ops_per_sec']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--playlist", type=int, default=1000, help="canciones de la playlist simulada")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latencia de cada extract_info falso")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior")
+    args = parser.parse_args()
+
+    install_stub_yt_dlp()
+    import commands_music
+
+    results = []
+    for size in args.sizes:
+        for result in queue_benchmarks(commands_music, size):
+            results.append(result)
+            print(f"{result['benchmark']:<18} {size:>7}  {result['ops_per_sec']:>12.0f} ops/s  "
+                  f"p50 {result['p50_us']:>9.2f}µs  p99 {result['p99_us']:>9.2f}µs  "
+                  f"pico {result['peak_memory_bytes'] / 1024:>9.1f} KiB")
+        memory = song_memory(commands_music, size)
+        results.append(memory)
+        print(f"{'song_memory':<18} {size:>7}  {memory['bytes_per_song_dict']:>8.0f} B/canción con dict, "
+              f"{memory['bytes_per_song_slots']:>6.0f} B/canción con Song")
+
+    for mode in ("jit", "resolve"):
+        ingestion = asyncio.run(ingest_playlist(commands_music, args.playlist, args.latency_ms / 1000, mode))
+        results.append(ingestion)
+        first_play = ingestion['time_to_first_play_s']
+        print(f"playlist de {args.playlist} ({mode}): primera canción en "
+              f"{'-' if first_play is None else f'{first_play:.3f}s'}, "
+              f"en cola en {ingestion['time_to_queued_s']:.3f}s, {ingestion['extract_info_calls']} extracciones, "
+              f"{ingestion['progress_edits']} ediciones")
+
+    report = {
+        'date': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,129 @@
+import time
+_start = time.perf_counter()  # Para el informe de arranque
+
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
+import hashlib
+import json
 import os
-from commands_poo import setup_poo_commands  # Importamos la configuración de comandos
+
+# Se carga antes de importar los comandos, que leen su configuración del entorno
+load_dotenv()
+
+from commands_poo import setup_poo_commands, close_poo_storage  # Importamos la configuración de comandos
 from commands_music import setup_music_commands
+from commands_stats import setup_stats_commands
+from metrics import metrics, start_exporter
+from sharding import parse_shard_ids, report_health, use_fake_gateway
+
+# Huella de los comandos de la última sincronización, para no repetirla si no cambiaron
+SYNC_STATE_FILE = os.getenv("COMMAND_SYNC_FILE", ".command_sync.json")
+
+# Segundos desde que arrancó el proceso hasta cada fase
+startup_times = {"import": time.perf_counter() - _start}
+metrics.register_gauge("bot_startup_seconds", lambda: {
+    (("phase", phase),): seconds for phase, seconds in startup_times.items()
+})
+
+def command_tree_hash(tree):
+    """Huella de los nombres, descripciones, opciones y permisos de todos los comandos."""
+    payload = []
+    for command in tree.get_commands():
+        try:
+            payload.append(command.to_dict(tree))
+        except TypeError:
+            payload.append(command.to_dict())  # Versiones de discord.py sin el parámetro tree
+    payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
 
+def load_sync_state():
+    try:
+        with open(SYNC_STATE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
+def save_sync_state(state):
+    try:
+        with open(SYNC_STATE_FILE, "w") as f:
+            json.dump(state, f)
+    except OSError as e:
+        print(f"No se pudo guardar {SYNC_STATE_FILE}: {str(e)}")
 
 # Configuración del bot
-class MonkeBot(commands.Bot):
-    def __init__(self):
+class MonkeBot(commands.AutoShardedBot):
+    """Bot con uno o varios shards en este proceso.
+
+    Sin BOT_SHARD_IDS se conecta a todos los shards que recomiende Discord. El
+    lanzador sharding.py arranca varios procesos y le da a cada uno su rango.
+    """
+    def __init__(self, shard_ids=None, shard_count=None):
         intents = discord.Intents.all()
-        super().__init__(command_prefix="!", intents=intents)
+        super().__init__(command_prefix="!", intents=intents, shard_ids=shard_ids, shard_count=shard_count)
+        metrics.register_gauge("discord_shard_latency_seconds", lambda: {
+            (("shard", str(shard_id)),): latency
+            for shard_id, latency in self.latencies if latency == latency  # NaN hasta el primer heartbeat
+        })
 
     async def setup_hook(self):
-        await self.tree.sync()  # Sincroniza los comandos con el servidor
+        # setup_hook se ejecuta justo después del login
+        startup_times["login"] = time.perf_counter() - _start
+        # Con varios procesos solo sincroniza uno: los comandos son globales
+        if os.getenv("BOT_SYNC_COMMANDS", "1") == "1":
+            await self.sync_commands()
+        startup_times["sync"] = time.perf_counter() - _start
+        await start_exporter()  # Publica las métricas si se configuró METRICS_PORT o METRICS_FILE
+        health_file = os.getenv("BOT_HEALTH_FILE")
+        if health_file:
+            interval = float(os.getenv("BOT_HEALTH_SECONDS", "5"))
+            self.loop.create_task(report_health(self, health_file, interval))
 
-bot = MonkeBot()
+    async def sync_commands(self):
+        """Sincroniza los comandos con el servidor solo si cambiaron desde la última vez.
 
-@bot.event
-async def on_ready():
-    print(f"Bot {bot.user} conectado y listo.")
+        El sync es una llamada global con límite de uso; FORCE_SYNC=1 lo fuerza.
+        """
+        state = {"application_id": self.application_id, "hash": command_tree_hash(self.tree)}
+        if os.getenv("FORCE_SYNC", "0") != "1" and load_sync_state() == state:
+            print("Comandos sin cambios, no se sincronizan.")
+            return
+        await self.tree.sync()
+        save_sync_state(state)
+        print("Comandos sincronizados.")
 
-# Cargar comandos
-setup_music_commands(bot)
-setup_poo_commands(bot)
+    async def on_ready(self):
+        if "ready" not in startup_times:  # on_ready se repite tras cada reconexión
+            startup_times["ready"] = time.perf_counter() - _start
+            print("Arranque: " + " · ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_times.items()))
+        print(f"Bot {self.user} conectado y listo (shards {sorted(self.shards)} de {self.shard_count}, {len(self.guilds)} servidores).")
 
-# Inicia el bot con el token de tu archivo .env
-load_dotenv()
-TOKEN = os.getenv("DISCORD_TOKEN")
-if TOKEN:
-    bot.run(TOKEN)
-else:
-    print("Token no encontrado. Verifica tu archivo .env.")
+    async def close(self):
+        await close_poo_storage()  # Guarda los datos pendientes antes de salir
+        await super().close()
+
+def main():
+    # Inicia el bot con el token de tu archivo .env
+    token = os.getenv("DISCORD_TOKEN")
+    if not token:
+        print("Token no encontrado. Verifica tu archivo .env.")
+        return
+
+    fake_gateway = os.getenv("DISCORD_FAKE_GATEWAY")
+    if fake_gateway:
+        use_fake_gateway(fake_gateway)  # Pruebas locales con fake_gateway.py
+    shard_count = os.getenv("BOT_SHARD_COUNT")
+    bot = MonkeBot(
+        shard_ids=parse_shard_ids(os.getenv("BOT_SHARD_IDS", "")),
+        shard_count=int(shard_count) if shard_count else None,
+    )
+
+    # Cargar comandos
+    setup_music_commands(bot)
+    setup_poo_commands(bot)
+    setup_stats_commands(bot)
+
+    bot.run(token)
+
+if __name__ == "__main__":
+    main()
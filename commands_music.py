@@ -1,22 +1,179 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import yt_dlp
 from collections import deque
 import asyncio
-from typing import Dict, Optional
+import itertools
+import math
+import random
+import atexit
+import os
+import shutil
+import sys
+import time
+from enum import Enum
+from typing import Dict, List, Optional
+from admission import AdmissionControl, parse_rate
+from extraction_pool import BACKGROUND, INTERACTIVE, ExtractionPool, download, extract
+from metrics import metrics, timed_command
+from queue_journal import QueueJournal
+from music_cache import AudioCache, SearchCache, StreamCache, TitleIndex, parse_video_id
+
+YTDL_OPTIONS = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': False,
+    'extract_flat': 'in_playlist',
+    'ignoreerrors': True
+}
+VIDEO_OPTIONS = dict(YTDL_OPTIONS, noplaylist=True)
+
+# Caché compartida entre servidores: un mismo vídeo se resuelve una sola vez
+stream_cache = StreamCache(
+    max_entries=int(os.getenv("MUSIC_CACHE_SIZE", "1000")),
+    path=os.getenv("MUSIC_CACHE_FILE"),
+)
+stream_cache.load()
+atexit.register(stream_cache.save)
+
+# Búsquedas de texto recientes: repetir una búsqueda no vuelve a pasar por ytsearch
+search_cache = SearchCache(ttl=int(os.getenv("MUSIC_SEARCH_TTL", "3600")))
+
+# Títulos ya reproducidos para autocompletar /play; arranca con los de la caché guardada
+title_index = TitleIndex(max_entries=int(os.getenv("MUSIC_TITLE_INDEX_SIZE", "5000")))
+for cached_id, cached_entry in stream_cache.entries.items():
+    title_index.add(cached_id, cached_entry['title'], cached_entry.get('webpage_url'))
+
+# Caché opcional del audio en disco: solo se activa si se indica un directorio
+audio_cache = None
+if os.getenv("MUSIC_AUDIO_CACHE_DIR"):
+    audio_cache = AudioCache(
+        os.getenv("MUSIC_AUDIO_CACHE_DIR"),
+        max_bytes=int(os.getenv("MUSIC_AUDIO_CACHE_MB", "1024")) * 1024 * 1024,
+    )
+
+def cache_counters():
+    counters = {(("cache", "stream"), ("result", "hit")): stream_cache.hits,
+                (("cache", "stream"), ("result", "miss")): stream_cache.misses,
+                (("cache", "search"), ("result", "hit")): search_cache.hits,
+                (("cache", "search"), ("result", "miss")): search_cache.misses}
+    if audio_cache is not None:
+        counters[(("cache", "audio"), ("result", "hit"))] = audio_cache.hits
+        counters[(("cache", "audio"), ("result", "miss"))] = audio_cache.misses
+    return counters
+
+metrics.register_gauge("music_cache_lookups_total", cache_counters, kind="counter")
+
+# Pool propio para yt_dlp: no compite con el executor por defecto del bucle
+extraction_pool = ExtractionPool(
+    workers=int(os.getenv("EXTRACT_WORKERS", "4")),
+    mode=os.getenv("EXTRACT_POOL", "thread").lower(),
+)
+atexit.register(extraction_pool.shutdown)
+metrics.register_gauge("extraction_pool_pending", lambda: {
+    (("priority", priority),): count for priority, count in extraction_pool.pending().items()
+})
+metrics.register_gauge("extraction_pool_active", lambda: {(): extraction_pool.active})
+
+# Control de admisión de /play: peticiones y extracciones por usuario y por
+# servidor ("usos/segundos"), para que nadie acapare el bot
+admission = AdmissionControl(
+    user_requests=parse_rate(os.getenv("MUSIC_USER_REQUESTS", "10/60")),
+    guild_requests=parse_rate(os.getenv("MUSIC_GUILD_REQUESTS", "30/60")),
+    user_extractions=parse_rate(os.getenv("MUSIC_USER_EXTRACTIONS", "6/60")),
+    guild_extractions=parse_rate(os.getenv("MUSIC_GUILD_EXTRACTIONS", "20/60")),
+)
+MAX_QUEUE = int(os.getenv("MUSIC_MAX_QUEUE", "5000"))  # Canciones pendientes por servidor (0 = sin límite)
+MAX_PLAYLIST = int(os.getenv("MUSIC_MAX_PLAYLIST", "500"))  # Canciones que se toman de una playlist (0 = todas)
+# Con límite, yt_dlp deja de listar la playlist en cuanto tiene las que se van a
+# usar (más una, para saber si había más)
+URL_OPTIONS = dict(YTDL_OPTIONS, playlistend=MAX_PLAYLIST + 1) if MAX_PLAYLIST else YTDL_OPTIONS
+metrics.register_gauge("music_admission_rejections_total", lambda: {
+    (("scope", scope), ("limit", kind)): count for (scope, kind), count in admission.rejections.items()
+}, kind="counter")
+
+REJECTION_MESSAGES = {
+    ("user", "requests"): "Estás usando /play demasiado seguido.",
+    ("guild", "requests"): "Este servidor está usando /play demasiado seguido.",
+    ("user", "extractions"): "Has pedido demasiadas canciones nuevas seguidas.",
+    ("guild", "extractions"): "Este servidor ha pedido demasiadas canciones nuevas seguidas.",
+}
+
+def rejection_message(scope, kind, wait):
+    return f"{REJECTION_MESSAGES[(scope, kind)]} Prueba de nuevo en {max(1, math.ceil(wait))}s."
+
+def queue_room(music_queue):
+    """Canciones que aún caben en la cola, o None si no hay límite."""
+    if not MAX_QUEUE:
+        return None
+    return max(0, MAX_QUEUE - len(music_queue.play_order)) if music_queue else MAX_QUEUE
+
+def limit_playlist(entries, music_queue):
+    """Recorta las entradas de una playlist a MAX_PLAYLIST y al hueco que queda en la cola.
+
+    Devuelve (entradas aceptadas, aviso para el usuario o "" si entran todas).
+    """
+    room = queue_room(music_queue)
+    if room is not None and len(entries) > room and (not MAX_PLAYLIST or room < MAX_PLAYLIST):
+        return entries[:room], f" La cola está llena (máximo {MAX_QUEUE} canciones): solo caben {room} más."
+    if MAX_PLAYLIST and len(entries) > MAX_PLAYLIST:
+        return entries[:MAX_PLAYLIST], f" Solo se toman las primeras {MAX_PLAYLIST} canciones de una playlist."
+    return entries, ""
+
+def limit_extractions(entries, guild, user):
+    """Cobra una extracción por cada entrada que no está en caché (modo resolve).
+
+    Si los cubos de extracciones no alcanzan, se corta la playlist en la
+    última entrada que cabe. Devuelve (entradas aceptadas, aviso o "").
+    """
+    uncached = [i for i, entry in enumerate(entries) if entry['id'] not in stream_cache]
+    granted = admission.take_extractions(guild, user, len(uncached))
+    if granted == len(uncached):
+        return entries, ""
+    return entries[:uncached[granted]], (
+        f" Solo se añaden {uncached[granted]} canciones: se acabó el cupo de canciones nuevas, prueba más tarde."
+    )
+
+def find_ffmpeg():
+    """Busca ffmpeg: FFMPEG_PATH, luego el PATH y por último la ruta clásica de Windows."""
+    configured = os.getenv("FFMPEG_PATH")
+    if configured:
+        return configured
+    found = shutil.which("ffmpeg")
+    if found:
+        return found
+    if os.path.exists("C:/ffmpeg/bin/ffmpeg.exe"):
+        return "C:/ffmpeg/bin/ffmpeg.exe"
+    return "ffmpeg"
+
+FFMPEG_EXECUTABLE = find_ffmpeg()
+# 'opus' envía tal cual el audio que ya viene en Opus; 'pcm' decodifica siempre (modo anterior)
+PLAYBACK_MODE = os.getenv("MUSIC_PLAYBACK_MODE", "opus").lower()
+# 'jit' encola las playlists al momento y resuelve cada canción al acercarse su turno;
+# 'resolve' resuelve todas las canciones antes de añadirlas (modo anterior)
+PLAYLIST_MODE = os.getenv("MUSIC_PLAYLIST_MODE", "jit").lower()
+# Canciones de una playlist que se resuelven a la vez en modo 'resolve'
+RESOLVE_CONCURRENCY = max(1, int(os.getenv("MUSIC_RESOLVE_CONCURRENCY", "4")))
+# Mínimo de segundos entre dos ediciones del mensaje de progreso de /play
+PROGRESS_INTERVAL = float(os.getenv("MUSIC_PROGRESS_SECONDS", "2"))
 
 class QueueView(discord.ui.View):
-    def __init__(self, queue_items, music_queue, per_page=10):
+    """Paginación de la cola que lee cada página de la cola en vivo al pulsar un botón."""
+    def __init__(self, music_queue, per_page=10):
         super().__init__(timeout=180)
-        self.queue_items = queue_items
         self.music_queue = music_queue
         self.per_page = per_page
         self.current_page = 0
-        self.total_pages = max((len(queue_items) - 1) // per_page + 1, 1)
         self.update_button_states()
 
+    @property
+    def total_pages(self):
+        return max((self.music_queue.display_count() - 1) // self.per_page + 1, 1)
+
     def update_button_states(self):
+        # La cola puede haber encogido desde la última página mostrada
+        self.current_page = min(self.current_page, self.total_pages - 1)
         self.first_page.disabled = self.current_page == 0
         self.prev_page.disabled = self.current_page == 0
         self.next_page.disabled = self.current_page >= self.total_pages - 1
@@ -25,16 +182,12 @@ class QueueView(discord.ui.View):
     def get_current_page_content(self):
         start = self.current_page * self.per_page
         end = start + self.per_page
-        current_items = self.queue_items[start:end]
+        current_items = self.music_queue.show(start, end)
         
         content = "**Cola de Reproducción**\n\n"
-        for i, item in enumerate(current_items, start=start + 1):
-            # Obtener los estados
-            state = item.get('state', '⏳')
-            shuffle_status = item.get('shuffle_status', '▶')
-            
+        for i, (state, song) in enumerate(current_items, start=start + 1):
             # Construir la línea con todos los indicadores
-            content += f"`{i}.` {state}{shuffle_status} **{item['title']}** (Añadido por: {item['added_by']})\n"
+            content += f"`{i}.` {state.value}{song.shuffle.value} **{song.title}** (Añadido por: {song.added_by})\n"
         
         content += f"\nPágina {self.current_page + 1}/{self.total_pages}"
         
@@ -66,28 +219,405 @@ class QueueView(discord.ui.View):
         self.current_page = self.total_pages - 1
         self.update_button_states()
         await interaction.response.edit_message(content=self.get_current_page_content(), view=self)
+class PlayOrder:
+    """Orden de reproducción indexado por id de canción.
+
+    Los ids se guardan en bloques (deques) de tamaño acotado. Sacar el primero
+    es O(1), saber si un id está en la cola es O(1) y quitar o insertar por
+    posición es O(log n) para encontrar el bloque más O(bloque) dentro de él.
+    """
+    _load = 256  # Tamaño de referencia de cada bloque
+
+    def __init__(self, ids=()):
+        self._blocks = []      # Lista de deques con los ids en orden
+        self._where = {}       # song_id -> bloque que lo contiene
+        self._tree = None      # Árbol de Fenwick con el tamaño de los bloques 1..n (None = reconstruir)
+        self._block_pos = {}   # id(bloque) -> posición en self._blocks
+        self._size = 0
+        for song_id in ids:
+            self.append(song_id)
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __contains__(self, song_id):
+        return song_id in self._where
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("índice fuera de rango")
+        k, i = self._locate(index)
+        return self._blocks[k][i]
+
+    def _rebuild(self):
+        # El primer bloque queda fuera del árbol para que popleft sea O(1)
+        sizes = [len(block) for block in self._blocks[1:]]
+        tree = [0] + sizes
+        for j in range(1, len(tree)):
+            parent = j + (j & -j)
+            if parent < len(tree):
+                tree[parent] += tree[j]
+        self._tree = tree
+        self._block_pos = {id(block): k for k, block in enumerate(self._blocks)}
+
+    def _ensure_index(self):
+        if self._tree is None:
+            self._rebuild()
+
+    def _tree_add(self, k, delta):
+        if self._tree is None:
+            return
+        while k < len(self._tree):
+            self._tree[k] += delta
+            k += k & -k
+
+    def _tree_prefix(self, k):
+        total = 0
+        while k > 0:
+            total += self._tree[k]
+            k -= k & -k
+        return total
+
+    def _locate(self, index):
+        """Devuelve (bloque, posición dentro del bloque) para un índice global."""
+        first = len(self._blocks[0])
+        if index < first:
+            return 0, index
+        self._ensure_index()
+        index -= first
+        k = 0
+        bit = 1 << (len(self._tree) - 1).bit_length()
+        while bit:
+            nxt = k + bit
+            if nxt < len(self._tree) and self._tree[nxt] <= index:
+                k = nxt
+                index -= self._tree[nxt]
+            bit >>= 1
+        return k + 1, index
+
+    def _shrunk(self, k):
+        block = self._blocks[k]
+        if not block:
+            del self._blocks[k]
+            self._tree = None
+        elif k:
+            self._tree_add(k, -1)
+
+    def append(self, song_id):
+        if not self._blocks or len(self._blocks[-1]) >= 2 * self._load:
+            self._blocks.append(deque())
+            self._tree = None
+        block = self._blocks[-1]
+        block.append(song_id)
+        self._where[song_id] = block
+        self._size += 1
+        if len(self._blocks) > 1:
+            self._tree_add(len(self._blocks) - 1, 1)
+
+    def insert(self, index, song_id):
+        """Inserta un id antes de la posición indicada."""
+        index = max(0, min(index, self._size))
+        if index == self._size:
+            self.append(song_id)
+            return
+        k, i = self._locate(index)
+        block = self._blocks[k]
+        block.insert(i, song_id)
+        self._where[song_id] = block
+        self._size += 1
+        if len(block) > 2 * self._load:
+            # Partir el bloque en dos para mantener acotado el coste de insertar
+            tail = deque(block.popleft() for _ in range(self._load))
+            block, tail = tail, block
+            self._blocks[k:k + 1] = [block, tail]
+            for moved in block:
+                self._where[moved] = block
+            self._tree = None
+        elif k:
+            self._tree_add(k, 1)
+
+    def popleft(self):
+        block = self._blocks[0]
+        song_id = block.popleft()
+        del self._where[song_id]
+        self._size -= 1
+        if not block:
+            del self._blocks[0]
+            self._tree = None
+        return song_id
+
+    def pop(self, index):
+        """Quita y devuelve el id en la posición indicada."""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("índice fuera de rango")
+        if index == 0:
+            return self.popleft()
+        k, i = self._locate(index)
+        block = self._blocks[k]
+        song_id = block[i]
+        del block[i]
+        del self._where[song_id]
+        self._size -= 1
+        self._shrunk(k)
+        return song_id
+
+    def remove(self, song_id):
+        block = self._where.pop(song_id)
+        self._ensure_index()
+        k = self._block_pos[id(block)]
+        block.remove(song_id)
+        self._size -= 1
+        self._shrunk(k)
+
+    def index(self, song_id):
+        block = self._where[song_id]
+        self._ensure_index()
+        k = self._block_pos[id(block)]
+        offset = 0 if k == 0 else len(self._blocks[0]) + self._tree_prefix(k - 1)
+        return offset + block.index(song_id)
+
+    def slice(self, start, stop):
+        """Devuelve los ids entre start y stop sin recorrer la cola entera."""
+        start = max(start, 0)
+        stop = min(stop, self._size)
+        if start >= stop:
+            return []
+        k, i = self._locate(start)
+        result = []
+        while len(result) < stop - start:
+            block = self._blocks[k]
+            for song_id in itertools.islice(block, i, i + stop - start - len(result)):
+                result.append(song_id)
+            k += 1
+            i = 0
+        return result
+
+    def clear(self):
+        self._blocks.clear()
+        self._where.clear()
+        self._block_pos.clear()
+        self._tree = None
+        self._size = 0
+
+async def resolve_in_order(entries, resolve, limit):
+    """Resuelve las entradas con como mucho `limit` en paralelo y las devuelve en orden.
+
+    Genera tuplas (entrada, resultado); si la resolución falla, el resultado es
+    la excepción. Al cerrar o cancelar el generador se cancelan las pendientes.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(entry):
+        async with semaphore:
+            return await resolve(entry)
+
+    # Ventana acotada de tareas para no lanzar miles a la vez en playlists grandes
+    entries = iter(entries)
+    window = deque(
+        (entry, asyncio.ensure_future(run(entry)))
+        for entry in itertools.islice(entries, limit * 2)
+    )
+    try:
+        while window:
+            entry, task = window.popleft()
+            try:
+                result = await task
+            except Exception as e:
+                result = e
+            for next_entry in itertools.islice(entries, 1):
+                window.append((next_entry, asyncio.ensure_future(run(next_entry))))
+            yield entry, result
+    finally:
+        for _, task in window:
+            task.cancel()
+
+class ProgressMessage:
+    """Mensaje de progreso que se edita como mucho una vez cada `interval` segundos.
+
+    update() solo guarda el texto más reciente y vuelve enseguida; una tarea
+    aparte lo envía cuando toca, así los cambios intermedios se juntan en una
+    sola edición y quien informa del progreso nunca espera a Discord (ni a sus
+    límites de uso). El último texto siempre se envía, aunque sea más tarde.
+    """
+    def __init__(self, message, interval=PROGRESS_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._content = None  # Último texto pedido que aún no se ha enviado
+        self._last_edit = float("-inf")
+        self._task = None
+
+    def update(self, content):
+        self._content = content
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._send())
+
+    async def _send(self):
+        loop = asyncio.get_running_loop()
+        while self._content is not None:
+            wait = self._last_edit + self.interval - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            content, self._content = self._content, None
+            self._last_edit = loop.time()
+            try:
+                await self.message.edit(content=content)
+            except Exception as e:
+                print(f"Error actualizando el mensaje de progreso: {str(e)}")
+
+    def finish(self, content):
+        """Deja el estado final para enviar; devuelve la tarea por si hay que esperarla."""
+        self.update(content)
+        return self._task
+
+# Extracciones en curso por id de vídeo, para no resolver dos veces el mismo a la vez
+_pending_resolves: Dict[str, asyncio.Future] = {}
+
+async def _extract_into_cache(video_id, video_url, priority, guild, user):
+    video_info = await extraction_pool.run(
+        "video", extract, video_url, VIDEO_OPTIONS, priority=priority, guild=guild, user=user, key=("video", video_id)
+    )
+    if not video_info:
+        return None
+    return stream_cache.put(video_id, video_info)
+
+# Descargas en curso por id de vídeo
+_pending_downloads: Dict[str, asyncio.Future] = {}
+
+async def _download_into_cache(video_id, video_url, guild):
+    opts = dict(VIDEO_OPTIONS, outtmpl=audio_cache.output_template(video_id))
+    try:
+        path = await extraction_pool.run("download", download, video_url, opts, priority=BACKGROUND, guild=guild)
+    except Exception as e:
+        print(f"Error guardando el audio de {video_id} en la caché: {str(e)}")
+        return
+    # Solo entra en la caché el archivo completo: hasta entonces se reproduce por streaming
+    if path and os.path.exists(path):
+        audio_cache.add(video_id, path)
+
+def cache_audio(video_id, video_url=None, guild=None):
+    """Empieza a descargar el audio del vídeo a la caché en disco si aún no está en ella.
+
+    No espera a la descarga: la canción ya se puede reproducir por streaming.
+    """
+    if audio_cache is None or video_id in audio_cache or video_id in _pending_downloads:
+        return
+    video_url = video_url or f"https://www.youtube.com/watch?v={video_id}"
+    task = asyncio.ensure_future(_download_into_cache(video_id, video_url, guild))
+    _pending_downloads[video_id] = task
+    task.add_done_callback(lambda _: _pending_downloads.pop(video_id, None))
+
+async def resolve_video(video_id, video_url=None, priority=BACKGROUND, guild=None, user=None):
+    """Devuelve título, duración y URL vigente de un vídeo, extrayéndolo solo si hace falta.
+
+    `priority`, `guild` y `user` deciden el turno en el pool de extracción.
+    """
+    entry = stream_cache.get(video_id)
+    if entry:
+        return entry
+    task = _pending_resolves.get(video_id)
+    if task is None:
+        cached = stream_cache.entries.get(video_id)
+        video_url = video_url or (cached and cached['webpage_url']) or f"https://www.youtube.com/watch?v={video_id}"
+        task = asyncio.ensure_future(_extract_into_cache(video_id, video_url, priority, guild, user))
+        _pending_resolves[video_id] = task
+        task.add_done_callback(lambda _: _pending_resolves.pop(video_id, None))
+    elif priority == INTERACTIVE:
+        # Ya se estaba extrayendo en segundo plano y ahora alguien espera: pasa por delante
+        extraction_pool.promote(("video", video_id))
+    # shield: si quien espera se cancela, la extracción sigue para los demás
+    return await asyncio.shield(task)
+
+class ShuffleMark(Enum):
+    """Cómo llegó una canción a su posición; el valor es el icono de /queue."""
+    IN_ORDER = "▶️"
+    SHUFFLED = "🔀"
+    ADDED_SHUFFLED = "❇️"  # Añadida al azar con el shuffle activo
+
+class SongState(Enum):
+    """Estado de una fila de /queue; el valor es su icono."""
+    PLAYING = "🔊"
+    READY = "✅"
+    PENDING = "⏳"
+
+def song_page_url(video_id, url):
+    """Página desde la que volver a resolver una canción, o None si es de YouTube.
+
+    De un id de YouTube se reconstruye el enlace; de otras webs (SoundCloud...)
+    hace falta guardar la página, o tras expulsarlo de stream_cache o reiniciar
+    se intentaría resolver como vídeo de YouTube.
+    """
+    if not video_id or not url or parse_video_id(url) == video_id:
+        return None
+    return url
+
+class Song:
+    """Canción en cola, con __slots__ para que las playlists grandes ocupen poco.
+
+    No guarda la URL de streaming: para los vídeos con id la tiene stream_cache,
+    que sabe cuándo caduca, y se pide al abrir el audio. `url` solo se usa para
+    lo que no tiene id de vídeo (enlaces de otras webs). `page_url` es la página
+    desde la que volver a resolver un id que no es de YouTube (ver song_page_url).
+    """
+    __slots__ = ('id', 'title', 'video_id', 'added_by', 'user_id', 'shuffle', 'url', 'page_url')
+
+    def __init__(self, title, video_id=None, added_by="", url=None, user_id=None, page_url=None):
+        self.id = None
+        self.title = title
+        self.video_id = video_id
+        self.added_by = sys.intern(added_by)  # Un mismo usuario suele añadir muchas canciones
+        self.user_id = user_id  # Id de Discord de quien la añadió: el turno en el pool de extracción
+        self.shuffle = ShuffleMark.IN_ORDER
+        self.url = url
+        self.page_url = page_url
+
+    def to_record(self):
+        """Forma compacta para el diario en disco."""
+        return [self.id, self.title, self.video_id, self.added_by, self.url, self.shuffle.name, self.user_id,
+                self.page_url]
+
+    @classmethod
+    def from_record(cls, record):
+        # Los diarios antiguos no traen id de usuario ni página
+        song_id, title, video_id, added_by, url, shuffle, user_id, page_url = (record + [None, None])[:8]
+        song = cls(title, video_id, added_by, url, user_id=user_id, page_url=page_url)
+        song.id = song_id
+        song.shuffle = ShuffleMark[shuffle]
+        return song
+
 class MusicQueue:
-    def __init__(self):
-        self.queue = deque()
-        self.download_queue = deque()
+    def __init__(self, seed=None, guild_id=None):
+        self.guild_id = guild_id  # Para repartir las extracciones por servidor
+        self.play_order = PlayOrder()  # Ids pendientes en orden de reproducción
+        self.ready_ids = set()  # Ids con el audio listo para reproducir
         self.current = None
         self.downloading = False
         self._download_task = None
         self.is_adding_to_queue = False
         self.pending_items = 0
-        self.play_order = []
         self.song_ids = {}
         self.next_id = 0
-        self.pending_entries = []
-        self.shuffle_mode = False
         self.download_limit = 3
-        self.processed_count = 0
-        self.shuffle_batch = 0
-        self.last_shuffle_time = None
-        self.processed_count = 0
-        self.pending_shuffle = False
+        self.resolve_limit = RESOLVE_CONCURRENCY  # Resoluciones de playlist simultáneas
+        self.playlist_tasks = set()  # Tareas que están añadiendo playlists
         self.shuffle_active = False  # Nueva bandera para indicar si el shuffle está activo
-        self.batch_size = 20  # Añadido: Define el tamaño del lote para el shuffle
+        self.rng = random.Random(seed)  # Con semilla, las mezclas son reproducibles
+        self._work_event = asyncio.Event()  # Hay canciones que preparar por adelantado
+        self._ready_event = asyncio.Event()  # Cambió la canción que va a sonar a continuación
+        self.next_source = None  # (song_id, fuente de audio) abierta por adelantado
+        self._prepare_task = None
+        self.track_ended_at = None  # perf_counter() del final de la última canción, para medir el hueco
+        self.journal = None  # QueueJournal si la cola se guarda en disco
 
 
     def generate_song_id(self):
@@ -95,286 +625,488 @@ class MusicQueue:
         self.next_id += 1
         return song_id
 
-    def add(self, item):
+    def add(self, song):
         """Añade una canción a la cola con el estado apropiado."""
         song_id = self.generate_song_id()
-        item['id'] = song_id
+        song.id = song_id
+        self.song_ids[song_id] = song
         
         # Asignar estado de mezcla basado en si el shuffle está activo
         if self.shuffle_active:
-            item['shuffle_status'] = "❇️"
-            self.processed_count += 1  # Solo incrementar si shuffle está activo
-            
-            # Verificar si necesitamos mezclar
-            if self.processed_count >= self.batch_size:
-                self.pending_shuffle = True  # Marcar para mezcla en el próximo ciclo
-        else:
-            item['shuffle_status'] = "▶️"
-            
-        self.song_ids[song_id] = item
-        self.queue.append(song_id)
-        
-        if not self.play_order:
-            self.play_order = list(self.download_queue) + list(self.queue)
+            # Con el shuffle activo, cada canción nueva va a una posición al azar
+            # de la parte no precargada, sin volver a mezclar toda la cola
+            song.shuffle = ShuffleMark.ADDED_SHUFFLED
+            start = min(self.download_limit, len(self.play_order))
+            position = self.rng.randint(start, len(self.play_order))
+            self.play_order.insert(position, song_id)
         else:
+            song.shuffle = ShuffleMark.IN_ORDER
+            position = None
             self.play_order.append(song_id)
-
-
-    def _update_shuffle_order(self):
-        """Actualiza el orden de reproducción cuando se agregan nuevas canciones"""
-        import random
-        if not self.play_order:
-            return
-        
-        # Obtener todos los IDs actuales
-        all_ids = list(self.download_queue) + list(self.queue)
-        # Agregar nuevos IDs al orden de reproducción
-        new_ids = set(all_ids) - set(self.play_order)
-        if new_ids:
-            new_ids_list = list(new_ids)
-            random.shuffle(new_ids_list)
-            self.play_order.extend(new_ids_list)
+        if self.journal is not None:
+            self.journal.record("add", song=song.to_record(), at=position)
+        self._work_event.set()
 
     async def shuffle(self):
-        """Marca las canciones pendientes con ❇️ y mezcla las ya procesadas."""
-        from datetime import datetime
-        import random
-        
-        # Marcar el momento del shuffle
-        self.last_shuffle_time = datetime.now()
-        self.pending_shuffle = True
+        """Mezcla toda la cola pendiente y activa el modo shuffle.
+
+        Una sola pasada de Fisher-Yates (random.shuffle) sobre las pendientes,
+        que quedan marcadas como SHUFFLED. Las que se añadan después, mientras
+        el modo siga activo, se insertan al azar una a una (ADDED_SHUFFLED).
+        """
         self.shuffle_active = True  # Activar el modo shuffle
         
-        # Obtener todas las canciones actuales
-        current_songs = list(self.download_queue) + list(self.queue)
-        if not current_songs:
+        if not self.play_order:
             return "EMPTY"
 
-        # Marcar canciones pendientes con ❇️
-        for song_id in self.queue:
-            self.song_ids[song_id]['shuffle_status'] = "❇️"
-        
-        # Mezclar solo las canciones ya descargadas
-        downloaded_songs = list(self.download_queue)
-        if downloaded_songs:
-            random.shuffle(downloaded_songs)
-            for song_id in downloaded_songs:
-                self.song_ids[song_id]['shuffle_status'] = "🔀"
-        
-        # Actualizar las colas
-        self.download_queue = deque(downloaded_songs)
+        songs = list(self.play_order)
+        self.rng.shuffle(songs)
+        for song_id in songs:
+            self.song_ids[song_id].shuffle = ShuffleMark.SHUFFLED
         
         # Actualizar el orden de reproducción
-        self.play_order = list(self.download_queue) + list(self.queue)
+        self.play_order = PlayOrder(songs)
+        if self.journal is not None:
+            self.journal.replace_with(self.snapshot())  # Cambió todo el orden: mejor un snapshot que n líneas
+        self._work_event.set()
         
         return "SUCCESS"
 
+    def pop(self):
+        """Obtiene la siguiente canción a reproducir (quien llama la pone como actual)."""
+        if self.journal is not None:
+            self.journal.record("pop")
+        if not self.play_order:
+            return None
+        next_id = self.play_order.popleft()
+        self.ready_ids.discard(next_id)
+        self._work_event.set()  # Avanza la ventana de precarga
+        return self.song_ids.pop(next_id)
 
+    def remove(self, index):
+        """Quita la canción en la posición indicada (empezando en 1) de la cola."""
+        if not 1 <= index <= len(self.play_order):
+            return None
+        song_id = self.play_order.pop(index - 1)
+        self.ready_ids.discard(song_id)
+        if self.journal is not None:
+            self.journal.record("del", id=song_id)
+        self._work_event.set()
+        return self.song_ids.pop(song_id)
 
-    def pop(self):
-        """Obtiene la siguiente canción a reproducir."""
-        if not self.play_order and (self.download_queue or self.queue):
-            self.play_order = list(self.download_queue) + list(self.queue)
+    def display_count(self):
+        """Número de filas que muestra /queue: la canción actual más las pendientes."""
+        return len(self.play_order) + (1 if self.current else 0)
 
-        while self.play_order:
-            next_id = self.play_order[0]
-            self.play_order.pop(0)
-            
-            # Buscar y remover el ID de cualquiera de las colas
-            if next_id in self.download_queue:
-                self.download_queue.remove(next_id)
-                return self.song_ids[next_id]
-            elif next_id in self.queue:
-                self.queue.remove(next_id)
-                return self.song_ids[next_id]
-        
-        return None
+    def show(self, start, stop):
+        """Devuelve (SongState, canción) para las filas start..stop de /queue.
 
-    def show(self):
-        """Muestra todas las canciones en la cola respetando el orden de play_order."""
-        all_songs = []
-        
-        # Añadir la canción actual si existe
+        Solo recorre las filas pedidas, así el coste no depende del tamaño de la cola.
+        Las canciones no se copian: la vista las lee en el momento de pintar.
+        """
+        rows = []
         if self.current:
-            current_copy = dict(self.current)
-            current_copy['state'] = "🔊"
-            all_songs.append(current_copy)
-
-        # Si no hay play_order, crear uno nuevo
-        if not self.play_order and (self.download_queue or self.queue):
-            self.play_order = list(self.download_queue) + list(self.queue)
-
-        # Añadir canciones en el orden de play_order
-        for song_id in self.play_order:
-            if song_id in self.song_ids:
-                song = dict(self.song_ids[song_id])
-                # Establecer el estado basado en la ubicación real de la canción
-                if song_id in self.download_queue:
-                    song['state'] = "✅"
-                else:
-                    song['state'] = "⏳"
-                all_songs.append(song)
+            if start == 0 and stop > 0:
+                rows.append((SongState.PLAYING, self.current))
+            start, stop = max(start - 1, 0), stop - 1
 
-        return all_songs
+        for song_id in self.play_order.slice(start, stop):
+            # Establecer el estado basado en si el audio ya está listo
+            state = SongState.READY if song_id in self.ready_ids else SongState.PENDING
+            rows.append((state, self.song_ids[song_id]))
+        return rows
+
+    def snapshot(self):
+        """Estado completo de la cola para compactar el diario."""
+        return {
+            "songs": [self.song_ids[song_id].to_record() for song_id in self.play_order],
+            "current": self.current.to_record() if self.current else None,
+            "next_id": self.next_id,
+            "shuffle": self.shuffle_active,
+        }
+
+    def restore(self, state):
+        """Recupera la cola guardada sin resolver nada: process_downloads resolverá
+        las primeras cuando vuelva a sonar. La canción que sonaba vuelve al principio."""
+        records = ([state["current"]] if state["current"] else []) + state["songs"]
+        songs = [Song.from_record(record) for record in records]
+        self.song_ids = {song.id: song for song in songs}
+        self.play_order = PlayOrder(song.id for song in songs)
+        self.next_id = state["next_id"]
+        self.shuffle_active = state["shuffle"]
+        self._work_event.set()
 
     def clear(self):
         """Limpia todas las colas y reinicia el estado"""
-        self.queue.clear()
-        self.download_queue.clear()
+        self.ready_ids.clear()
         self.current = None
         self.play_order.clear()
         self.song_ids.clear()
         self.next_id = 0
         self.shuffle_active = False  # Resetear el estado de shuffle
-        self.pending_shuffle = False
-        self.processed_count = 0
-        self.pending_entries.clear()
-    
-    async def auto_shuffle(self):
-        """Mezcla automáticamente la cola."""
-        import random
+        self.is_adding_to_queue = False
+        self.pending_items = 0
+        self._ready_event.set()  # Despierta a quien esperaba una canción
+        self.discard_next_source()
 
-        # Guardar la canción actual
-        current_id = None
-        if self.current and 'id' in self.current:
-            current_id = self.current['id']
+    def take_next_source(self, song_id):
+        """Devuelve la fuente abierta por adelantado si es la de esta canción."""
+        if self.next_source and self.next_source[0] == song_id:
+            source = self.next_source[1]
+            self.next_source = None
+            return source
+        self.discard_next_source()
+        return None
 
-        # Combinar canciones procesadas y pendientes
-        all_songs = list(self.queue) + list(self.download_queue) + self.pending_entries
-        random.shuffle(all_songs)
+    def discard_next_source(self):
+        if self.next_source:
+            self.next_source[1].cleanup()  # Termina el proceso de ffmpeg
+            self.next_source = None
+    
+    def finish_adding(self):
+        """Marca que terminó de añadirse contenido y avisa al reproductor."""
+        self.is_adding_to_queue = False
+        self._ready_event.set()
 
-        # Actualizar colas
-        self.queue.clear()
-        self.download_queue.clear()
-        self.queue.extend(all_songs)
+    async def wait_ready(self, timeout=None):
+        """Espera a que la siguiente canción de la cola tenga el audio listo.
 
-        # Actualizar el orden de reproducción
-        self.play_order = list(self.queue)
+        Devuelve enseguida si la cola está vacía y no se está añadiendo nada.
+        Devuelve True si hay una canción lista para sonar.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            if self.play_order and self.play_order[0] in self.ready_ids:
+                return True
+            if not self.play_order and not self.is_adding_to_queue:
+                return False
+            if self.play_order:
+                # Alguien espera a esta canción: si su extracción está en cola, que pase delante
+                next_song = self.song_ids[self.play_order[0]]
+                if next_song.video_id:
+                    extraction_pool.promote(("video", next_song.video_id))
+            self._ready_event.clear()
+            self._work_event.set()
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._ready_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
 
-        # Restaurar la canción actual
-        if current_id:
-            self.play_order.insert(0, current_id)
+    def _next_to_prefetch(self):
+        """Primera canción dentro de la ventana de precarga que aún no está lista."""
+        for song_id in self.play_order.slice(0, self.download_limit):
+            if song_id not in self.ready_ids:
+                return song_id
+        return None
 
-        # Reiniciar las canciones descargadas (excepto la actual)
-        self.download_queue.clear()
-        if current_id:
-            self.download_queue.append(current_id)
+    async def _prefetch(self, song_id):
+        song = self.song_ids[song_id]
+        # La que va a sonar a continuación no espera detrás de las precargas de nadie
+        priority = INTERACTIVE if self.play_order and self.play_order[0] == song_id else BACKGROUND
+        self.downloading = True
+        try:
+            if song.video_id:
+                entry = await resolve_video(
+                    song.video_id, song.page_url, priority=priority, guild=self.guild_id, user=song.user_id
+                )
+                if entry:
+                    # Lista en cuanto se resuelve; el audio se guarda en disco por detrás
+                    cache_audio(song.video_id, entry['webpage_url'], guild=self.guild_id)
+        except Exception as e:
+            # Se marca igualmente como lista: play_audio lo reintentará o la saltará
+            print(f"Error preparando '{song.title}': {str(e)}")
+        finally:
+            self.downloading = False
 
-    async def shuffle_pending(self):
-        """Mezcla los elementos marcados con ❇️"""
-        import random
-        
-        # Recolectar todos los IDs de canciones con estado ❇️
-        pending_songs = [
-            song_id for song_id in self.queue
-            if self.song_ids[song_id].get('shuffle_status') == "❇️"
-        ]
-        
-        if not pending_songs:
-            return
-            
-        # Mezclar las canciones pendientes
-        random.shuffle(pending_songs)
-        
-        # Actualizar estados y posiciones
-        for song_id in pending_songs:
-            self.song_ids[song_id]['shuffle_status'] = "🔀"
-        
-        # Actualizar la cola manteniendo el orden de las canciones no mezcladas
-        non_pending = [
-            song_id for song_id in self.queue
-            if self.song_ids[song_id].get('shuffle_status') != "❇️"
-        ]
-        
-        # Reconstruir la cola con el nuevo orden
-        self.queue = deque(pending_songs + non_pending)
-        
-        # Actualizar el orden de reproducción
-        self.play_order = list(self.download_queue) + list(self.queue)
+        if song_id in self.play_order:  # Pudo quitarse de la cola mientras se resolvía
+            self.ready_ids.add(song_id)
+            self._ready_event.set()
 
     async def process_downloads(self):
+        """Prepara por adelantado las próximas `download_limit` canciones de la cola.
+
+        Duerme hasta que la cola cambia (add, pop, remove, shuffle...) en lugar
+        de revisarla a intervalos fijos.
+        """
         while True:
+            await self._work_event.wait()
+            self._work_event.clear()
             try:
-                downloaded_count = len(self.download_queue) + (1 if self.current else 0)
-                
-                if downloaded_count < self.download_limit and self.queue and not self.downloading:
-                    self.downloading = True
-                    try:
-                        if self.pending_shuffle and self.processed_count >= self.batch_size:
-                            await self.shuffle_pending()
-                            self.processed_count = 0
-                            self.pending_shuffle = False
-                            
-                        next_id = self.queue[0]
-                        next_song = self.song_ids[next_id]
-
-                        if not next_song.get('downloaded', False):
-                            # Aquí va el código de descarga existente
-                            pass
-                            
-                    finally:
-                        self.downloading = False
-
-                await asyncio.sleep(1)
+                next_id = self._next_to_prefetch()
+                while next_id is not None:
+                    await self._prefetch(next_id)
+                    next_id = self._next_to_prefetch()
             except Exception as e:
                 print(f"Error en process_downloads: {str(e)}")
-                await asyncio.sleep(1)
+
+class MusicRegistry:
+    """Mantiene una MusicQueue independiente por servidor (guild).
+
+    Con `journal_dir`, cada cola se guarda en un diario en disco que se escribe
+    cada `flush_interval` segundos, y tras un reinicio se recupera la primera
+    vez que el servidor usa un comando de música.
+    """
+    def __init__(self, journal_dir=None, flush_interval=5):
+        self.queues: Dict[int, MusicQueue] = {}
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self._flush_task = None
+        self._deleting: Dict[int, asyncio.Future] = {}  # Diarios que se están borrando en un hilo
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+
+    def _journal_path(self, guild_id):
+        return os.path.join(self.journal_dir, f"{guild_id}.jsonl")
+
+    def _create(self, guild_id):
+        music_queue = MusicQueue(guild_id=guild_id)
+        if self.journal_dir:
+            journal = QueueJournal(self._journal_path(guild_id))
+            # Si el diario anterior aún se está borrando, no queda nada que recuperar
+            state = None if guild_id in self._deleting else journal.load()
+            if state is not None:
+                music_queue.restore(state)
+                # Se compacta enseguida: descarta líneas cortadas y el estado ya recuperado
+                journal.replace_with(music_queue.snapshot())
+            music_queue.journal = journal
+            if self._flush_task is None or self._flush_task.done():
+                self._flush_task = asyncio.create_task(self._flush_periodically())
+        self.queues[guild_id] = music_queue
+        return music_queue
+
+    def get(self, guild_id: int) -> MusicQueue:
+        """Devuelve la cola del servidor, creándola (o recuperándola del diario) la primera vez que se usa."""
+        music_queue = self.queues.get(guild_id)
+        if music_queue is None:
+            music_queue = self._create(guild_id)
+        return music_queue
+
+    def peek(self, guild_id: int) -> Optional[MusicQueue]:
+        """Devuelve la cola del servidor sin crearla, salvo que haya una guardada en disco."""
+        music_queue = self.queues.get(guild_id)
+        if (music_queue is None and self.journal_dir and guild_id not in self._deleting
+                and os.path.exists(self._journal_path(guild_id))):
+            music_queue = self._create(guild_id)
+        return music_queue
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for music_queue in list(self.queues.values()):
+                journal = music_queue.journal
+                if music_queue.guild_id in self._deleting:
+                    continue  # Se escribe cuando termine de borrarse el diario anterior, no antes
+                try:
+                    if journal.needs_compaction(len(music_queue.play_order)):
+                        journal.replace_with(music_queue.snapshot())
+                    if journal.has_pending():  # Los servidores sin cambios no gastan un salto a otro hilo
+                        await asyncio.to_thread(journal.flush)
+                except Exception as e:
+                    print(f"Error guardando la cola de {music_queue.guild_id}: {str(e)}")
+
+    def flush_journals(self):
+        """Escribe lo pendiente de todas las colas (al apagar el bot)."""
+        for music_queue in list(self.queues.values()):
+            if music_queue.journal is not None:
+                try:
+                    music_queue.journal.flush()
+                except Exception as e:
+                    print(f"Error guardando la cola de {music_queue.guild_id}: {str(e)}")
+
+    def _delete_journal(self, guild_id, journal):
+        try:
+            if journal is not None:
+                journal.delete()
+            elif os.path.exists(self._journal_path(guild_id)):
+                os.remove(self._journal_path(guild_id))
+        except OSError as e:
+            print(f"Error borrando la cola guardada de {guild_id}: {str(e)}")
+
+    def remove(self, guild_id: int):
+        """Detiene la tarea de descargas del servidor y descarta su estado, también el guardado."""
+        music_queue = self.queues.pop(guild_id, None)
+        if self.journal_dir:
+            # Se borra en un hilo: delete() espera a un flush en curso y ese puede estar en un fsync
+            journal = music_queue.journal if music_queue is not None else None
+            task = asyncio.ensure_future(asyncio.to_thread(self._delete_journal, guild_id, journal))
+            self._deleting[guild_id] = task
+            task.add_done_callback(
+                lambda done: self._deleting.pop(guild_id) if self._deleting.get(guild_id) is done else None
+            )
+        if music_queue is None:
+            return
+        if music_queue._download_task and not music_queue._download_task.done():
+            music_queue._download_task.cancel()
+        if music_queue._prepare_task and not music_queue._prepare_task.done():
+            music_queue._prepare_task.cancel()
+        for playlist_task in list(music_queue.playlist_tasks):
+            playlist_task.cancel()
+        music_queue.clear()
+
+async def create_source(url, codec=None, before_options=''):
+    """Abre la fuente de audio sin recodificar si el original ya está en Opus.
+
+    Si se conoce el códec (yt_dlp lo informa en 'acodec') no hace falta sondear
+    el stream. Solo se usa PCM si así se configura o si no se puede abrir en Opus.
+    """
+    ffmpeg_options = {
+        'before_options': before_options,
+        'options': '-vn -bufsize 64k'
+    }
+    if PLAYBACK_MODE == 'opus':
+        try:
+            if codec:
+                # FFmpegOpusAudio copia el stream si es Opus y si no lo convierte dentro de ffmpeg
+                return discord.FFmpegOpusAudio(url, codec=codec, executable=FFMPEG_EXECUTABLE, **ffmpeg_options)
+            return await discord.FFmpegOpusAudio.from_probe(url, executable=FFMPEG_EXECUTABLE, **ffmpeg_options)
+        except Exception as e:
+            print(f"No se pudo abrir el audio en Opus, se usa PCM: {str(e)}")
+    return discord.FFmpegPCMAudio(url, executable=FFMPEG_EXECUTABLE, **ffmpeg_options)
+
+async def open_song_source(song, guild=None, priority=INTERACTIVE):
+    """Abre la fuente de audio de una canción: desde la caché en disco o desde una URL vigente."""
+    url = song.url
+    video_id = song.video_id
+    local_path = audio_cache.get(video_id) if audio_cache and video_id else None
+    if video_id and not local_path:
+        # La URL vigente sale de la caché; si caducó mientras esperaba en la cola, se vuelve a resolver
+        entry = await resolve_video(video_id, song.page_url, priority=priority, guild=guild, user=song.user_id)
+        if entry:
+            url = entry['url']
+    cached = stream_cache.entries.get(video_id) if video_id else None
+    codec = cached.get('acodec') if cached else None
+
+    before_options = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+    if local_path:
+        # Reproducir desde la caché en disco: no hace falta reconectar
+        url = local_path
+        before_options = ''
+    with metrics.timer("ffmpeg_source_seconds", origin="local" if local_path else "stream"):
+        return await create_source(url, codec, before_options)
+
+async def prepare_next_source(music_queue):
+    """Abre la fuente de la siguiente canción mientras suena la actual.
+
+    Así ffmpeg ya está arrancado y conectado cuando la canción actual termina
+    o se salta, y el cambio de pista es inmediato.
+    """
+    try:
+        if not await music_queue.wait_ready():
+            return
+        song_id = music_queue.play_order[0]
+        if music_queue.next_source and music_queue.next_source[0] == song_id:
+            return
+        music_queue.discard_next_source()
+        # Es la canción que va a sonar: su extracción, si hace falta, no espera a las precargas
+        source = await open_song_source(music_queue.song_ids[song_id], music_queue.guild_id, INTERACTIVE)
+        if music_queue.play_order and music_queue.play_order[0] == song_id:
+            music_queue.next_source = (song_id, source)
+        else:
+            source.cleanup()  # La cola cambió mientras se abría
+    except Exception as e:
+        print(f"Error preparando la siguiente canción: {str(e)}")
+
+def schedule_prepare(music_queue):
+    """Lanza (si no está ya en marcha) la preparación de la siguiente canción."""
+    if music_queue._prepare_task is None or music_queue._prepare_task.done():
+        music_queue._prepare_task = asyncio.create_task(prepare_next_source(music_queue))
 
 async def play_audio(vc, music_queue):
     if music_queue.current:
         try:
-            url = music_queue.current['url']
-            
             def after_playing(error):
                 if error:
                     print(f"Error en la reproducción: {error}")
+                music_queue.track_ended_at = time.perf_counter()
                 asyncio.run_coroutine_threadsafe(play_next(vc, music_queue), vc.loop)
 
-            ffmpeg_options = {
-                'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-                'options': '-vn -bufsize 64k'
-            }
-            
-            source = discord.FFmpegPCMAudio(
-                url, 
-                executable="C:/ffmpeg/bin/ffmpeg.exe",
-                **ffmpeg_options
-            )
+            # Usar la fuente abierta por adelantado si corresponde a esta canción
+            song = music_queue.current
+            source = music_queue.take_next_source(song.id)
+            preopened = source is not None
+            if source is None:
+                source = await open_song_source(song, music_queue.guild_id)
+                if not vc.is_connected() or music_queue.current is not song:
+                    # /stop (o algo que cambió la canción) llegó mientras se abría
+                    source.cleanup()
+                    return
             vc.play(source, after=after_playing)
+            if music_queue.current.video_id:
+                title_index.add(music_queue.current.video_id, music_queue.current.title, music_queue.current.page_url)
+            if music_queue.track_ended_at is not None:
+                # Hueco entre el final de la canción anterior y el inicio de esta
+                metrics.observe("track_gap_seconds", time.perf_counter() - music_queue.track_ended_at,
+                                preopened=str(preopened).lower())
+                music_queue.track_ended_at = None
+            schedule_prepare(music_queue)
             
         except Exception as e:
             print(f"Error reproducing audio: {str(e)}")
             await play_next(vc, music_queue)
 
 async def play_next(vc, music_queue):
-    await asyncio.sleep(1)
-    
     if not vc.is_connected():
         return
-        
+
+    # Esperar a que la siguiente canción esté lista; si aún se está añadiendo
+    # una playlist, esperar a que llegue alguna
+    await music_queue.wait_ready(timeout=30)
+    if not vc.is_connected() or vc.is_playing():
+        return  # Mientras esperaba, otro comando ya empezó la siguiente o se paró todo
     next_song = music_queue.pop()
     
     if next_song:
         music_queue.current = next_song
         await play_audio(vc, music_queue)
-    elif music_queue.queue or music_queue.is_adding_to_queue:
-        # Esperar brevemente por nuevas canciones
-        for _ in range(10):  # 5 segundos máximo de espera
-            if music_queue.download_queue:
-                next_song = music_queue.pop()
-                if next_song:
-                    music_queue.current = next_song
-                    await play_audio(vc, music_queue)
-                break
-            await asyncio.sleep(0.5)
+    elif music_queue.is_adding_to_queue:
+        # La playlist que se está añadiendo reanudará la reproducción
+        music_queue.current = None
+        music_queue.track_ended_at = None  # La espera a la playlist no cuenta como hueco
     else:
         music_queue.current = None
         await vc.disconnect()
 
+async def start_if_idle(vc, music_queue):
+    """Empieza a reproducir si no suena nada; si ya suena, prepara la siguiente canción."""
+    if not vc.is_playing() and not music_queue.current:
+        await music_queue.wait_ready(timeout=5)
+        if not vc.is_playing() and not music_queue.current:
+            next_song = music_queue.pop()
+            if next_song:
+                music_queue.current = next_song
+                await play_audio(vc, music_queue)
+    else:
+        # Si es la siguiente en sonar, abrirla ya para que el cambio sea inmediato
+        schedule_prepare(music_queue)
+
 def setup_music_commands(bot):
-    music_queue = MusicQueue()
+    registry = MusicRegistry(
+        journal_dir=os.getenv("MUSIC_QUEUE_DIR"),
+        flush_interval=float(os.getenv("MUSIC_QUEUE_FLUSH_SECONDS", "5")),
+    )
+    atexit.register(registry.flush_journals)
+
+    async def on_voice_state_update(member, before, after):
+        # Cuando el bot sale del canal de voz se libera el estado de ese servidor,
+        # salvo al apagarse: entonces la cola guardada se conserva para el reinicio
+        if bot.is_closed():
+            return
+        if bot.user and member.id == bot.user.id and before.channel and not after.channel:
+            registry.remove(member.guild.id)
+
+    bot.add_listener(on_voice_state_update)
+
+    # Canciones pendientes por servidor; se calcula solo cuando se leen las métricas
+    metrics.register_gauge("music_queue_depth", lambda: {
+        (("guild", guild_id),): len(music_queue.play_order) for guild_id, music_queue in registry.queues.items()
+    })
 
     @bot.tree.command(name="play", description="Reproduce una canción o añade a la cola.")
+    @timed_command
     async def play(interaction: discord.Interaction, query: str = None):
         if not query:
             if not interaction.guild.voice_client or not interaction.guild.voice_client.is_paused():
@@ -387,213 +1119,199 @@ def setup_music_commands(bot):
         if not interaction.user.voice or not interaction.user.voice.channel:
             await interaction.response.send_message("¡Debes estar en un canal de voz!")
             return
-        
+
+        # Admisión: se decide antes de conectar o responder, así el rechazo es inmediato
+        # y no gasta nada. Lo que ya está en caché no cuenta como extracción.
+        video_id = parse_video_id(query) if "http" in query else None
+        searched_id = None if "http" in query else search_cache.get(query)
+        if queue_room(registry.peek(interaction.guild.id)) == 0:
+            admission.reject("guild", "queue")
+            await interaction.response.send_message(
+                f"La cola está llena (máximo {MAX_QUEUE} canciones). Espera a que avance o usa /remove.", ephemeral=True
+            )
+            return
+        needs_extraction = not (video_id in stream_cache or searched_id)
+        rejected = admission.admit(interaction.guild.id, interaction.user.id, extractions=1 if needs_extraction else 0)
+        if rejected:
+            await interaction.response.send_message(rejection_message(*rejected), ephemeral=True)
+            return
+
         vc = interaction.guild.voice_client
         if not vc:
             vc = await interaction.user.voice.channel.connect()
 
+        music_queue = registry.get(interaction.guild.id)
         if not music_queue._download_task or music_queue._download_task.done():
             music_queue._download_task = asyncio.create_task(music_queue.process_downloads())
 
         # Enviar mensaje inicial
         await interaction.response.send_message("Procesando solicitud...")
-        original_message = await interaction.original_response()
+        progress = ProgressMessage(await interaction.original_response())
 
         try:
-            ytdl_opts = {
-                'format': 'bestaudio/best',
-                'quiet': True,
-                'no_warnings': True,
-                'noplaylist': False,
-                'extract_flat': 'in_playlist',
-                'ignoreerrors': True
-            }
-
-            with yt_dlp.YoutubeDL(ytdl_opts) as ydl:
-                try:
-                    music_queue.is_adding_to_queue = True
-                    
-                    if "http" in query:
-                        playlist_info = await asyncio.get_event_loop().run_in_executor(
-                            None,
-                            lambda: ydl.extract_info(query, download=False)
-                        )
-                    else:
-                        search_result = await asyncio.get_event_loop().run_in_executor(
-                            None,
-                            lambda: ydl.extract_info(f"ytsearch:{query}", download=False)
-                        )
-                        playlist_info = search_result['entries'][0] if 'entries' in search_result else search_result
-
-                    if 'entries' in playlist_info:
-                        entries = [entry for entry in playlist_info['entries'] if entry]
-                        music_queue.pending_items = len(entries)
-                        await original_message.edit(content=f"Procesando playlist con {music_queue.pending_items} elementos...")
-                        
-                        # Procesar primera canción inmediatamente
-                        if entries:
-                            first_entry = entries[0]
-                            video_opts = dict(ytdl_opts)
-                            video_opts['noplaylist'] = True
-                            
-                            with yt_dlp.YoutubeDL(video_opts) as video_ydl:
-                                try:
-                                    video_url = f"https://www.youtube.com/watch?v={first_entry['id']}"
-                                    video_info = await asyncio.get_event_loop().run_in_executor(
-                                        None,
-                                        lambda: video_ydl.extract_info(video_url, download=False)
-                                    )
-                                    
-                                    if video_info:
-                                        music_queue.add({
-                                            'title': video_info.get('title', 'Unknown Title'),
-                                            'url': video_info.get('url', video_url),
-                                            'added_by': interaction.user.name,
-                                            'downloaded': True  # Marcar como descargada
-                                        })
-                                        
-                                        # Iniciar reproducción inmediatamente
-                                        if not vc.is_playing() and not music_queue.current:
-                                            next_song = music_queue.pop()
-                                            if next_song:
-                                                music_queue.current = next_song
-                                                await play_audio(vc, music_queue)
-                                    
-                                    music_queue.pending_items -= 1
-                                    
-                                    # Procesar resto de la playlist en segundo plano
-                                    for entry in entries[1:]:
-                                        try:
-                                            video_url = f"https://www.youtube.com/watch?v={entry['id']}"
-                                            video_info = await asyncio.get_event_loop().run_in_executor(
-                                                None,
-                                                lambda: video_ydl.extract_info(video_url, download=False)
-                                            )
-                                            
-                                            if video_info:
-                                                music_queue.add({
-                                                    'title': video_info.get('title', 'Unknown Title'),
-                                                    'url': video_info.get('url', video_url),
-                                                    'added_by': interaction.user.name,
-                                                    'downloaded': True
-                                                })
-                                                
-                                            music_queue.pending_items -= 1
-                                            
-                                            # Actualizar mensaje cada 5 canciones procesadas
-                                            if music_queue.pending_items % 5 == 0:
-                                                await original_message.edit(
-                                                    content=f"Procesando playlist... {music_queue.pending_items} elementos restantes"
-                                                )
-                                                
-                                        except Exception as e:
-                                            print(f"Error procesando video de playlist: {str(e)}")
-                                            music_queue.pending_items -= 1
-                                            continue
-                                            
-                                except Exception as e:
-                                    print(f"Error procesando primera canción: {str(e)}")
-                                    music_queue.pending_items -= 1
-                        
-                        music_queue.is_adding_to_queue = False
-                        await original_message.edit(content="Playlist procesada completamente.")
-                        
-                    else:  # Es un solo video
-                        # Añadir a la cola
-                        music_queue.add({
-                            'title': playlist_info['title'],
-                            'url': playlist_info.get('url', playlist_info.get('webpage_url')),
-                            'added_by': interaction.user.name,
-                            'downloaded': False
-                        })
-                        
-                        await original_message.edit(
-                            content=f"**{playlist_info['title']}** añadido a la cola por {interaction.user.name}."
-                        )
-                        
-                        # Iniciar reproducción si no hay nada reproduciéndose
-                        if not vc.is_playing() and not music_queue.current:
-                            for _ in range(10):  # Esperar hasta 5 segundos
-                                if music_queue.download_queue:
+            music_queue.is_adding_to_queue = True
+
+            if video_id in stream_cache:
+                # Resuelto hace poco: no hace falta volver a extraer
+                playlist_info = {'_type': 'url', 'id': video_id}
+            elif "http" in query:
+                playlist_info = await extraction_pool.run(
+                    "url", extract, query, URL_OPTIONS,
+                    priority=INTERACTIVE, guild=interaction.guild.id, user=interaction.user.id
+                )
+            elif searched_id:
+                # La misma búsqueda se hizo hace poco: se reutiliza su resultado
+                playlist_info = {'_type': 'url', 'id': searched_id}
+            else:
+                search_result = await extraction_pool.run(
+                    "search", extract, f"ytsearch:{query}", YTDL_OPTIONS,
+                    priority=INTERACTIVE, guild=interaction.guild.id, user=interaction.user.id
+                )
+                playlist_info = search_result['entries'][0] if 'entries' in search_result else search_result
+                if playlist_info.get('id'):
+                    search_cache.put(query, playlist_info['id'])
+
+            if 'entries' in playlist_info and PLAYLIST_MODE == 'jit':
+                # Las entradas planas ya traen id y título: se encolan tal cual y
+                # process_downloads resuelve solo las que están a punto de sonar
+                entries = [entry for entry in playlist_info['entries'] if entry and entry.get('id')]
+                entries, note = limit_playlist(entries, music_queue)
+                for entry in entries:
+                    music_queue.add(Song(
+                        entry.get('title') or entry['id'], entry['id'], interaction.user.name, user_id=interaction.user.id,
+                        page_url=song_page_url(entry['id'], entry.get('url'))
+                    ))
+                music_queue.finish_adding()
+                progress.finish(f"Playlist con {len(entries)} elementos añadida a la cola.{note}")
+                await start_if_idle(vc, music_queue)
+
+            elif 'entries' in playlist_info:
+                entries = [entry for entry in playlist_info['entries'] if entry and entry.get('id')]
+                entries, note = limit_playlist(entries, music_queue)
+                entries, limited = limit_extractions(entries, interaction.guild.id, interaction.user.id)
+                note = limited or note
+                music_queue.pending_items = len(entries)
+                progress.update(f"Procesando playlist con {music_queue.pending_items} elementos...")
+
+                async def resolve_entry(entry):
+                    # Las playlists van en segundo plano: no retrasan el /play de nadie
+                    return await resolve_video(
+                        entry['id'], entry.get('url'), guild=interaction.guild.id, user=interaction.user.id
+                    )
+
+                async def add_entries():
+                    # Las entradas se resuelven en paralelo pero se añaden en el orden de la playlist
+                    async for entry, result in resolve_in_order(entries, resolve_entry, music_queue.resolve_limit):
+                        if isinstance(result, Exception):
+                            print(f"Error procesando video de playlist: {str(result)}")
+                        else:
+                            video_info = result
+                            if video_info:
+                                music_queue.add(Song(
+                                    video_info['title'], entry['id'], interaction.user.name, user_id=interaction.user.id,
+                                    page_url=song_page_url(entry['id'], video_info.get('webpage_url'))
+                                ))
+
+                                # Iniciar reproducción en cuanto llega la primera canción
+                                if not vc.is_playing() and not music_queue.current:
                                     next_song = music_queue.pop()
                                     if next_song:
                                         music_queue.current = next_song
                                         await play_audio(vc, music_queue)
-                                        break
-                                await asyncio.sleep(0.5)
 
-                    music_queue.is_adding_to_queue = False
+                        music_queue.pending_items -= 1
+                        progress.update(f"Procesando playlist... {music_queue.pending_items} elementos restantes")
 
-                except Exception as e:
-                    music_queue.is_adding_to_queue = False
-                    await original_message.edit(content=f"Error al procesar la URL: {str(e)}")
+                # /stop cancela esta tarea a través del registro
+                playlist_task = asyncio.create_task(add_entries())
+                music_queue.playlist_tasks.add(playlist_task)
+                try:
+                    await playlist_task
+                except asyncio.CancelledError:
+                    progress.finish("Procesamiento de la playlist cancelado.")
                     return
+                finally:
+                    music_queue.playlist_tasks.discard(playlist_task)
+
+                music_queue.finish_adding()
+                progress.finish(f"Playlist procesada completamente.{note}")
+                        
+            else:  # Es un solo video
+                video_id = playlist_info.get('id')
+                if playlist_info.get('_type') == 'url':
+                    # Entrada plana (búsqueda o caché): la URL de streaming sale de la caché
+                    video_info = await resolve_video(
+                        video_id, playlist_info.get('url'),
+                        priority=INTERACTIVE, guild=interaction.guild.id, user=interaction.user.id
+                    )
+                elif video_id:
+                    video_info = stream_cache.put(video_id, playlist_info)
+                else:
+                    video_info = playlist_info
+
+                # Añadir a la cola
+                # Con id de vídeo la URL vive en stream_cache; sin él se guarda en la canción
+                music_queue.add(Song(
+                    video_info['title'], video_id, interaction.user.name,
+                    url=None if video_id else video_info.get('url', playlist_info.get('webpage_url')),
+                    user_id=interaction.user.id,
+                    page_url=song_page_url(video_id, video_info.get('webpage_url') or playlist_info.get('url'))
+                ))
+                        
+                progress.finish(f"**{video_info['title']}** añadido a la cola por {interaction.user.name}.")
+                        
+                await start_if_idle(vc, music_queue)
+
+            music_queue.finish_adding()
 
         except Exception as e:
-            music_queue.is_adding_to_queue = False
-            await original_message.edit(content=f"Error general: {str(e)}")
+            music_queue.finish_adding()
+            progress.finish(f"Error al procesar la URL: {str(e)}")
+
+    @play.autocomplete('query')
+    async def play_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        # Sugiere canciones ya reproducidas; al elegir una se envía su enlace, que no necesita búsqueda.
+        # Discord no acepta valores de más de 100 caracteres: esas páginas no se sugieren
+        links = ((title, title_index.link(video_id)) for video_id, title in title_index.search(current))
+        return [app_commands.Choice(name=title[:100], value=link) for title, link in links if len(link) <= 100]
 
     @bot.tree.command(name="queue", description="Muestra la cola actual.")
+    @timed_command
     async def queue(interaction: discord.Interaction):
-        all_songs = music_queue.show()
+        music_queue = registry.peek(interaction.guild.id)
 
-        if not all_songs:
+        if not music_queue or not music_queue.display_count():
             await interaction.response.send_message("La cola está vacía.")
             return
 
-        per_page = 10  # Número de elementos por página
-        total_pages = (len(all_songs) - 1) // per_page + 1
-        current_page = 0  # Inicialmente mostrar la primera página
-
-        def get_page_content(page, per_page, queue_items, total_pages, music_queue):
-            start = page * per_page
-            end = start + per_page
-            content = "**Cola de Reproducción**\n\n"
-
-            for i, item in enumerate(queue_items[start:end], start=start + 1):
-                state = item.get('state', "⏳")
-                shuffle_status = item.get('shuffle_status', "▶")  # `▶`, `🔀`, o `❇️`
-                content += f"`{i}.` {state}{shuffle_status} **{item['title']}** (Añadido por: {item['added_by']})\n"
-
-            content += f"\nPágina {page + 1}/{total_pages}"
-            if music_queue.is_adding_to_queue:
-                content += f"\n⏳ Aún hay {music_queue.pending_items} elementos siendo agregados a la cola..."
-            return content
-
-        # Enviar la primera página
-        content = get_page_content(
-            page=current_page,
-            per_page=per_page,
-            queue_items=all_songs,
-            total_pages=total_pages,
-            music_queue=music_queue
-        )
-        view = QueueView(all_songs, music_queue, per_page)
-        await interaction.response.send_message(content=content, view=view)
+        # La vista pide a la cola solo la página que muestra en cada momento
+        view = QueueView(music_queue, per_page=10)
+        await interaction.response.send_message(content=view.get_current_page_content(), view=view)
 
     @bot.tree.command(name="shuffle", description="Mezcla las canciones en la cola.")
+    @timed_command
     async def shuffle(interaction: discord.Interaction):
-        result = await music_queue.shuffle()
+        music_queue = registry.peek(interaction.guild.id)
+        result = await music_queue.shuffle() if music_queue else "EMPTY"
         
         if result == "EMPTY":
             await interaction.response.send_message("No hay canciones en la cola para mezclar.")
             return
 
-        # Cancelar las descargas actuales y priorizar las nuevas
-        if music_queue._download_task and not music_queue._download_task.done():
-            music_queue._download_task.cancel()
-        music_queue._download_task = asyncio.create_task(music_queue.process_downloads())
+        # No hace falta reiniciar las descargas: shuffle() despierta a process_downloads,
+        # que vuelve a calcular qué canciones preparar con el nuevo orden
+        await interaction.response.send_message("🔀 Cola mezclada exitosamente.")
 
-        # Verificar si hay reproducción activa
+        # Si no suena nada empieza a sonar; si no, cambió la siguiente canción y se
+        # vuelve a abrir por adelantado. start_if_idle no pisa una canción en pausa
+        # ni a play_next mientras espera la siguiente.
         vc = interaction.guild.voice_client
-        if vc and not vc.is_playing() and music_queue.play_order:
-            music_queue.current = music_queue.pop()
-            await play_audio(vc, music_queue)
-
-        await interaction.response.send_message("🔀 Cola mezclada exitosamente.")
+        if vc:
+            await start_if_idle(vc, music_queue)
 
 
     @bot.tree.command(name="pause", description="Pausa la reproducción.")
+    @timed_command
     async def pause(interaction: discord.Interaction):
         vc = interaction.guild.voice_client
         if not vc or not vc.is_playing():
@@ -603,14 +1321,16 @@ def setup_music_commands(bot):
         await interaction.response.send_message("Reproducción pausada.")
 
     @bot.tree.command(name="stop", description="Detiene la reproducción y limpia la cola.")
+    @timed_command
     async def stop(interaction: discord.Interaction):
         vc = interaction.guild.voice_client
         if vc:
             await vc.disconnect()
-        music_queue.clear()
+        registry.remove(interaction.guild.id)
         await interaction.response.send_message("Reproducción detenida y cola eliminada.")
 
     @bot.tree.command(name="skip", description="Salta la canción actual.")
+    @timed_command
     async def skip(interaction: discord.Interaction):
         vc = interaction.guild.voice_client
         if not vc or not vc.is_playing():
@@ -620,19 +1340,18 @@ def setup_music_commands(bot):
         await interaction.response.send_message("Canción saltada.")
 
     @bot.tree.command(name="remove", description="Elimina una canción de la cola.")
+    @timed_command
     async def remove(interaction: discord.Interaction, index: int):
+        music_queue = registry.peek(interaction.guild.id)
+        if not music_queue:
+            await interaction.response.send_message("La cola está vacía.")
+            return
         try:
-            # Ajustar para tener en cuenta ambas colas
-            all_queue = list(music_queue.download_queue) + list(music_queue.queue)
-            if 1 <= index <= len(all_queue):
-                if index <= len(music_queue.download_queue):
-                    removed = music_queue.download_queue[index - 1]
-                    del music_queue.download_queue[index - 1]
-                else:
-                    adjusted_index = index - len(music_queue.download_queue) - 1
-                    removed = music_queue.queue[adjusted_index]
-                    del music_queue.queue[adjusted_index]
-                await interaction.response.send_message(f"**{removed['title']}** eliminado de la cola.")
+            removed = music_queue.remove(index)
+            if removed:
+                if music_queue.current:
+                    schedule_prepare(music_queue)
+                await interaction.response.send_message(f"**{removed.title}** eliminado de la cola.")
             else:
                 await interaction.response.send_message("Índice fuera de rango.")
         except Exception as e:
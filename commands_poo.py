@@ -1,68 +1,131 @@
 import discord
 from discord import app_commands
-import json
+import asyncio
+import os
 from datetime import datetime, timedelta
-from pathlib import Path
+from metrics import metrics, timed_command
+from poo_storage import JsonPooStorage, RankingIndex, open_storage
 
-# Archivo de datos
+# Archivos de datos
 DATA_FILE = "poo_data.json"
+DB_FILE = os.getenv("POO_DB_FILE", "poo_data.db")
+COOLDOWN = timedelta(hours=3)
+FLUSH_INTERVAL = float(os.getenv("POO_FLUSH_SECONDS", "30"))  # Solo para el almacenamiento JSON
 
-# Inicializa o carga la base de datos
-if not Path(DATA_FILE).exists():
-    with open(DATA_FILE, "w") as f:
-        json.dump({"users": {}}, f)
+# Inicializa o carga la base de datos ('sqlite' migra poo_data.json la primera vez)
+storage = open_storage(os.getenv("POO_STORAGE", "sqlite"), DATA_FILE, DB_FILE)
 
-def load_data():
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
+# Con varios procesos (sharding.py) los demás también escriben en la base de
+# datos, así que /ranking pide cada página a SQLite en vez de fiarse de un índice local
+SHARED_STORAGE = os.getenv("BOT_WORKER") is not None
+# Con un solo proceso el ranking se ordena una vez al arrancar y después se actualiza con cada /poo
+ranking_index = None if SHARED_STORAGE else RankingIndex(storage.ranking())
 
-def save_data(data):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+if isinstance(storage, JsonPooStorage):
+    # Solo el almacenamiento JSON vuelca en segundo plano
+    metrics.register_gauge("poo_flushes_total", lambda: {(): storage.flushes}, kind="counter")
+    metrics.register_gauge("poo_flush_bytes_total", lambda: {(): storage.bytes_written}, kind="counter")
+
+async def ranking_page(start, stop, user_id):
+    """(usuarios en total, página, (posición, veces) de user_id o None) del ranking."""
+    if SHARED_STORAGE:
+        return await asyncio.to_thread(storage.ranking_page, start, stop, user_id)
+    position = ranking_index.position(user_id)
+    mine = (position, ranking_index.counts[user_id]) if position else None
+    return len(ranking_index), ranking_index.page(start, stop), mine
+
+async def close_poo_storage():
+    """Vuelca los cambios pendientes y cierra el almacenamiento al apagar el bot."""
+    storage.stop()  # La tarea de volcado es del bucle: se cancela en su hilo
+    await asyncio.to_thread(storage.close)
+
+class RankingView(discord.ui.View):
+    """Paginación del ranking, con el mismo estilo que la cola de música."""
+    def __init__(self, user_id, per_page=10):
+        super().__init__(timeout=180)
+        self.user_id = user_id
+        self.per_page = per_page
+        self.current_page = 0
+        self.total = 0  # Usuarios en el ranking, según la última página leída
+        self.update_button_states()
+
+    @property
+    def total_pages(self):
+        return max((self.total - 1) // self.per_page + 1, 1)
+
+    def update_button_states(self):
+        self.current_page = min(self.current_page, self.total_pages - 1)
+        self.first_page.disabled = self.current_page == 0
+        self.prev_page.disabled = self.current_page == 0
+        self.next_page.disabled = self.current_page >= self.total_pages - 1
+        self.last_page.disabled = self.current_page >= self.total_pages - 1
+
+    async def get_current_page_content(self):
+        """Lee la página actual y deja los botones de acuerdo con el total recién leído."""
+        start = self.current_page * self.per_page
+        self.total, rows, mine = await ranking_page(start, start + self.per_page, self.user_id)
+        self.update_button_states()
+        ranking_text = "\n".join(
+            f"{i}. <@{user_id}> - {count} {'vez' if count == 1 else 'veces'}"
+            for i, (user_id, count) in enumerate(rows, start=start + 1)
+        )
+        content = f"🏆 **Caca-Ranking:**\n{ranking_text}\n\nPágina {self.current_page + 1}/{self.total_pages}"
+
+        if mine:
+            position, count = mine
+            content += f"\nTu posición: #{position} ({count} {'vez' if count == 1 else 'veces'})"
+        return content
+
+    @discord.ui.button(label="<<", style=discord.ButtonStyle.gray)
+    async def first_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.current_page = 0
+        await interaction.response.edit_message(content=await self.get_current_page_content(), view=self)
+
+    @discord.ui.button(label="<", style=discord.ButtonStyle.gray)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.current_page = max(0, self.current_page - 1)
+        await interaction.response.edit_message(content=await self.get_current_page_content(), view=self)
+
+    @discord.ui.button(label=">", style=discord.ButtonStyle.gray)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.current_page = min(self.total_pages - 1, self.current_page + 1)
+        await interaction.response.edit_message(content=await self.get_current_page_content(), view=self)
+
+    @discord.ui.button(label=">>", style=discord.ButtonStyle.gray)
+    async def last_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.current_page = self.total_pages - 1
+        await interaction.response.edit_message(content=await self.get_current_page_content(), view=self)
 
 # Configuración de comandos
 def setup_poo_commands(bot):
     @bot.tree.command(name="poo", description="Registra que has ido al baño.")
+    @timed_command
     async def poo(interaction: discord.Interaction):
         user_id = str(interaction.user.id)
-        data = load_data()
         now = datetime.now()
+        storage.start(FLUSH_INTERVAL)
 
-        # Verifica si el usuario está en la base de datos
-        if user_id not in data["users"]:
-            data["users"][user_id] = {
-                "count": 0,
-                "last_used": "1970-01-01T00:00:00"
-            }
-
-        last_used = datetime.fromisoformat(data["users"][user_id]["last_used"])
-        if now - last_used < timedelta(hours=3):
-            remaining_time = timedelta(hours=3) - (now - last_used)
+        # La comprobación y la actualización van juntas, fuera del hilo del bot
+        remaining_time = await asyncio.to_thread(storage.register_use, user_id, now, COOLDOWN)
+        if remaining_time is not None:
             await interaction.response.send_message(
                 f"te duele el estómago? deberías esperar al menos {remaining_time} antes de usar este comando otra vez."
             )
             return
 
-        # Actualiza los datos del usuario
-        data["users"][user_id]["count"] += 1
-        data["users"][user_id]["last_used"] = now.isoformat()
-        save_data(data)
+        if ranking_index is not None:
+            ranking_index.increment(user_id)
 
         await interaction.response.send_message(
             f"¡{interaction.user.name} ha ido al baño!"
         )
 
     @bot.tree.command(name="ranking", description="Muestra quiénes han destrozado más su inodoro.")
+    @timed_command
     async def ranking(interaction: discord.Interaction):
-        data = load_data()
-        sorted_users = sorted(data["users"].items(), key=lambda x: x[1]["count"], reverse=True)
-        if not sorted_users:
+        view = RankingView(str(interaction.user.id))
+        content = await view.get_current_page_content()
+        if not view.total:
             await interaction.response.send_message("No hay datos en el ranking todavía.")
             return
-
-        ranking_text = "\n".join(
-            f"{i+1}. <@{user_id}> - {info['count']} {'vez' if info['count'] == 1 else 'veces'}"
-            for i, (user_id, info) in enumerate(sorted_users)
-        )
-
-        await interaction.response.send_message(f"🏆 **Caca-Ranking:**\n{ranking_text}")
+        await interaction.response.send_message(content=content, view=view)
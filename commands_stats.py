@@ -0,0 +1,65 @@
+import discord
+from discord import app_commands
+from metrics import metrics, timed_command
+
+
+def format_seconds(value):
+    if value is None:
+        return "-"
+    if value == float("inf"):
+        return ">30s"
+    return f"≤{value * 1000:.0f}ms" if value < 1 else f"≤{value:g}s"
+
+
+def format_summary(title, summary, prefix=""):
+    if not summary:
+        return f"**{title}:** sin datos"
+    lines = [f"**{title}:**"]
+    for key, (count, p50, p99) in summary.items():
+        lines.append(f"`{prefix}{key or '-'}` {count} · p50 {format_seconds(p50)} · p99 {format_seconds(p99)}")
+    return "\n".join(lines)
+
+
+def stats_content():
+    """Resumen de las métricas para /stats; el detalle completo está en el exportador."""
+    sections = [
+        "📊 **Estadísticas del bot**",
+        format_summary("Comandos", metrics.summary("command_latency_seconds", "command"), prefix="/"),
+        format_summary("extract_info", metrics.summary("extract_info_seconds", "kind")),
+        format_summary("Arranque de ffmpeg", metrics.summary("ffmpeg_source_seconds", "origin")),
+        format_summary("Hueco entre canciones (abierta por adelantado)", metrics.summary("track_gap_seconds", "preopened")),
+    ]
+
+    gauges = metrics.collect_gauges()
+    depths = list(gauges.get("music_queue_depth", ("gauge", {}))[1].values())
+    sections.append(
+        f"**Colas:** {len(depths)} servidores · {sum(depths)} canciones · máx {max(depths, default=0)}"
+    )
+    lookups = gauges.get("music_cache_lookups_total", ("counter", {}))[1]
+    for cache in ("stream", "audio"):
+        hits = lookups.get((("cache", cache), ("result", "hit")))
+        misses = lookups.get((("cache", cache), ("result", "miss")))
+        if hits is not None:
+            total = hits + misses
+            rate = f"{hits / total:.0%}" if total else "-"
+            sections.append(f"**Caché {cache}:** {hits} aciertos / {misses} fallos ({rate})")
+    rejections = gauges.get("music_admission_rejections_total", ("counter", {}))[1]
+    if rejections:
+        sections.append("**/play rechazados:** " + " · ".join(
+            f"{dict(labels)['scope']}/{dict(labels)['limit']} {count}" for labels, count in sorted(rejections.items())
+        ))
+    if "poo_flushes_total" in gauges:
+        flushes = gauges["poo_flushes_total"][1][()]
+        written = gauges["poo_flush_bytes_total"][1][()]
+        sections.append(f"**Volcados de poo_data.json:** {flushes} ({written / 1024:.1f} KiB)")
+
+    content = "\n\n".join(sections)
+    return content if len(content) <= 2000 else content[:1997] + "..."
+
+
+def setup_stats_commands(bot):
+    @bot.tree.command(name="stats", description="Muestra las métricas de rendimiento del bot.")
+    @app_commands.default_permissions(administrator=True)
+    @timed_command
+    async def stats(interaction: discord.Interaction):
+        await interaction.response.send_message(stats_content(), ephemeral=True)
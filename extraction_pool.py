@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from metrics import metrics
+
+INTERACTIVE = 0  # Alguien espera la respuesta: /play de una canción o búsqueda, o la canción que va a sonar
+BACKGROUND = 1   # Resolución de playlists, precarga y descargas
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+# Funciones que corren dentro del pool. Reciben las opciones como argumento para
+# poder ejecutarse también en otro proceso sin importar el módulo de comandos.
+# yt_dlp se importa en la primera extracción y no al arrancar el bot: tarda
+# bastante en cargarse y no hace falta hasta el primer comando de música.
+
+def extract(url, options):
+    import yt_dlp
+    # Una instancia por llamada: YoutubeDL no es seguro entre hilos
+    with yt_dlp.YoutubeDL(options) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def download(url, options):
+    """Descarga el audio y devuelve la ruta del archivo (o None si falló)."""
+    import yt_dlp
+    with yt_dlp.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=True)
+        return ydl.prepare_filename(info) if info else None
+
+
+class ExtractionPool:
+    """Pool dedicado a yt_dlp con reparto justo entre servidores y usuarios.
+
+    Como mucho `workers` extracciones a la vez, en hilos o en procesos. Las que
+    esperan se atienden primero por prioridad y, dentro de cada prioridad, por
+    turnos: un servidor tras otro y, dentro de cada servidor, un usuario tras
+    otro. Así una playlist enorme no deja sin turno al /play de los demás.
+    """
+    def __init__(self, workers=4, mode="thread"):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Tipo de pool de extracción desconocido: {mode}")
+        self.workers = workers
+        self.mode = mode
+        self.active = 0
+        self._executor = None
+        # prioridad -> servidor -> usuario -> trabajos en espera (en orden de turno)
+        self._pending = {INTERACTIVE: OrderedDict(), BACKGROUND: OrderedDict()}
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._queued = {}  # clave -> (prioridad, servidor, usuario, trabajo) de los que esperan, para promote()
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="extract")
+        return self._executor
+
+    def pending(self):
+        """Trabajos en espera por prioridad, para las métricas."""
+        return {PRIORITY_NAMES[priority]: count for priority, count in self._waiting.items()}
+
+    async def run(self, kind, func, *args, priority=BACKGROUND, guild=None, user=None, key=None):
+        """Ejecuta func(*args) en el pool cuando le llegue el turno y devuelve su resultado.
+
+        `kind` solo etiqueta las métricas. Si quien espera se cancela antes de
+        que empiece, el trabajo se descarta sin ocupar el pool. Con `key`, el
+        trabajo se puede subir de prioridad mientras espera (ver promote).
+        """
+        future = asyncio.get_running_loop().create_future()
+        job = (kind, func, args, future, time.perf_counter(), key)
+        self._enqueue(priority, guild, user, job)
+        self._dispatch()
+        return await future
+
+    def _enqueue(self, priority, guild, user, job):
+        users = self._pending[priority].setdefault(guild, OrderedDict())
+        users.setdefault(user, deque()).append(job)
+        self._waiting[priority] += 1
+        if job[5] is not None:
+            self._queued[job[5]] = (priority, guild, user, job)
+
+    def promote(self, key, priority=INTERACTIVE):
+        """Pasa a `priority` el trabajo con esa clave si aún espera con una prioridad menor.
+
+        Sirve cuando alguien se queda esperando algo que se pidió en segundo
+        plano, p. ej. la precarga de la canción que ya tiene que sonar.
+        """
+        queued = self._queued.get(key)
+        if queued is None or queued[0] <= priority:
+            return
+        old_priority, guild, user, job = queued
+        users = self._pending[old_priority][guild]
+        jobs = users[user]
+        jobs.remove(job)
+        self._waiting[old_priority] -= 1
+        if not jobs:
+            del users[user]
+        if not users:
+            del self._pending[old_priority][guild]
+        self._enqueue(priority, guild, user, job)
+        self._dispatch()
+
+    def _next_job(self):
+        for priority, guilds in self._pending.items():
+            while guilds:
+                guild, users = next(iter(guilds.items()))
+                user, jobs = next(iter(users.items()))
+                job = jobs.popleft()
+                self._waiting[priority] -= 1
+                if job[5] is not None:
+                    self._queued.pop(job[5], None)
+                # El usuario y el servidor pasan al final de su turno
+                del users[user]
+                if jobs:
+                    users[user] = jobs
+                del guilds[guild]
+                if users:
+                    guilds[guild] = users
+                if not job[3].cancelled():
+                    return priority, job
+        return None
+
+    def _dispatch(self):
+        while self.active < self.workers:
+            found = self._next_job()
+            if found is None:
+                return
+            priority, (kind, func, args, future, queued_at, _) = found
+            started = time.perf_counter()
+            metrics.observe("extraction_wait_seconds", started - queued_at, priority=PRIORITY_NAMES[priority])
+            self.active += 1
+            task = asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+            task.add_done_callback(functools.partial(self._finished, kind, started, future))
+
+    def _finished(self, kind, started, future, task):
+        self.active -= 1
+        metrics.observe("extract_info_seconds", time.perf_counter() - started, kind=kind)
+        if not future.cancelled():
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        self._dispatch()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,165 @@
+"""Pasarela de Discord falsa para probar el modo por shards sin conexión.
+
+Responde a las pocas rutas de la API que usa el bot al arrancar (login,
+información de la aplicación, /gateway/bot y el sync de comandos) y habla
+lo justo del protocolo del gateway: HELLO, IDENTIFY, READY, GUILD_CREATE y
+heartbeats. Reparte `guilds` servidores falsos entre los shards con la misma
+fórmula que Discord.
+
+Uso:
+    python fake_gateway.py --port 8765 --guilds 50 --shards 4
+    python sharding.py --fake-gateway --workers 2 --shards 4   # la arranca el lanzador
+"""
+import argparse
+import asyncio
+import json
+import time
+from aiohttp import WSMsgType, web
+
+APPLICATION_ID = "100000000000000000"
+BOT_USER = {
+    "id": APPLICATION_ID,
+    "username": "monkebot-falso",
+    "discriminator": "0",
+    "global_name": None,
+    "avatar": None,
+    "bot": True,
+}
+HEARTBEAT_INTERVAL_MS = 5000  # Corto para que la latencia de cada shard se mida pronto
+
+
+def json_response(payload):
+    # discord.py solo interpreta como JSON un content-type exacto, sin "; charset=..."
+    return web.Response(body=json.dumps(payload).encode(), content_type="application/json")
+
+
+class FakeGateway:
+    """Servidor HTTP + WebSocket que imita a Discord para un bot con shards."""
+    def __init__(self, guilds=50, shards=1, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.shards = shards
+        # Ids con forma de snowflake: el shard se calcula con (id >> 22) % shards
+        self.guild_ids = [str((1_000_000 + i) << 22) for i in range(guilds)]
+        self.identified = {}  # shard_id -> veces que se identificó
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def shard_guilds(self, shard_id, shard_count):
+        return [guild_id for guild_id in self.guild_ids if (int(guild_id) >> 22) % shard_count == shard_id]
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/api/v10/users/@me", self._json(BOT_USER))
+        app.router.add_get("/api/v10/oauth2/applications/@me", self._json({
+            "id": APPLICATION_ID, "name": "monkebot", "description": "", "icon": None,
+            "bot_public": True, "bot_require_code_grant": False, "owner": BOT_USER,
+            "verify_key": "", "flags": 0,
+        }))
+        app.router.add_get("/api/v10/gateway", self._gateway_info)
+        app.router.add_get("/api/v10/gateway/bot", self._gateway_info)
+        app.router.add_put("/api/v10/applications/{application_id}/commands", self._sync_commands)
+        app.router.add_get("/gateway", self._websocket)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # Puerto real si se pidió el 0
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    @staticmethod
+    def _json(payload):
+        async def handler(request):
+            return json_response(payload)
+        return handler
+
+    async def _gateway_info(self, request):
+        return json_response({
+            "url": f"ws://{self.host}:{self.port}/gateway",
+            "shards": self.shards,
+            "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1},
+        })
+
+    async def _sync_commands(self, request):
+        await request.json()
+        return json_response([])
+
+    async def _websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sequence = 0
+
+        async def dispatch(event, data):
+            nonlocal sequence
+            sequence += 1
+            await ws.send_str(json.dumps({"op": 0, "t": event, "s": sequence, "d": data}))
+
+        await ws.send_str(json.dumps({"op": 10, "d": {"heartbeat_interval": HEARTBEAT_INTERVAL_MS}, "s": None, "t": None}))
+        async for message in ws:
+            if message.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(message.data)
+            op = payload.get("op")
+            if op == 1:  # Heartbeat
+                await ws.send_str(json.dumps({"op": 11, "d": None, "s": None, "t": None}))
+            elif op == 2:  # Identify
+                shard_id, shard_count = payload["d"].get("shard", [0, 1])
+                self.identified[shard_id] = self.identified.get(shard_id, 0) + 1
+                guilds = self.shard_guilds(shard_id, shard_count)
+                await dispatch("READY", {
+                    "v": 10,
+                    "user": BOT_USER,
+                    "guilds": [{"id": guild_id, "unavailable": True} for guild_id in guilds],
+                    "session_id": f"falsa-{shard_id}-{time.time_ns()}",
+                    "resume_gateway_url": f"ws://{self.host}:{self.port}/gateway",
+                    "shard": [shard_id, shard_count],
+                    "application": {"id": APPLICATION_ID, "flags": 0},
+                })
+                for guild_id in guilds:
+                    await dispatch("GUILD_CREATE", {
+                        "id": guild_id,
+                        "name": f"Servidor {guild_id}",
+                        "unavailable": False,
+                        "member_count": 1,
+                        "owner_id": BOT_USER["id"],
+                        "roles": [],
+                        "channels": [],
+                        "members": [],
+                        "voice_states": [],
+                    })
+            elif op == 6:  # Resume: se fuerza una sesión nueva
+                await ws.send_str(json.dumps({"op": 9, "d": False, "s": None, "t": None}))
+        return ws
+
+
+async def serve(args):
+    gateway = FakeGateway(guilds=args.guilds, shards=args.shards, host=args.host, port=args.port)
+    await gateway.start()
+    print(f"Pasarela falsa en {gateway.url} ({args.guilds} servidores, {args.shards} shards)")
+    print(f"Arranca el bot con DISCORD_FAKE_GATEWAY={gateway.url} DISCORD_TOKEN=falso")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await gateway.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--shards", type=int, default=1, help="shards recomendados que anuncia /gateway/bot")
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""Prueba de carga del sistema de música, sin Discord ni YouTube.
+
+Registra los comandos de setup_music_commands en un bot falso y simula muchos
+servidores a la vez usando /play (vídeos, búsquedas y playlists), /skip,
+/shuffle y /stop. Los canales de voz son falsos: cada canción "suena" unos
+segundos y al terminar llama al callback after como lo haría discord.py.
+yt_dlp es el sustituto de bench_music.py, con latencia configurable y fallos
+opcionales.
+
+Al terminar informa del retraso del bucle de eventos, del hueco entre
+canciones (al acabar una y al saltarla), de la latencia de cada comando y de
+los errores, y sale con código 1 si se supera algún umbral, para usarla en CI.
+
+Uso:
+    python loadtest_music.py                                  # 50 servidores durante 30 s
+    python loadtest_music.py --guilds 200 --duration 60 --latency-ms 400
+    python loadtest_music.py --max-lag-ms 50 --max-gap-ms 300 --output carga.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import types
+from collections import Counter, defaultdict
+
+from bench_music import FakeBot, FakeMessage, FakeSource, StubYoutubeDL, install_stub_yt_dlp
+
+
+class LoadTestYoutubeDL(StubYoutubeDL):
+    """yt_dlp falso con latencia variable y una proporción de fallos."""
+    jitter = 0.0  # Fracción de la latencia que varía al azar
+    fail_rate = 0.0
+
+    def extract_info(self, url, download=False):
+        if self.fail_rate and random.random() < self.fail_rate:
+            time.sleep(self.latency)
+            raise RuntimeError(f"fallo simulado de yt_dlp en {url}")
+        latency = self.latency
+        if self.jitter:
+            self.latency = latency * random.uniform(1 - self.jitter, 1 + self.jitter)
+        try:
+            return super().extract_info(url, download)
+        finally:
+            self.latency = latency
+
+
+class SimVoiceClient:
+    """Canal de voz falso: cada canción dura `track_seconds` y al acabar llama a after."""
+    def __init__(self, guild, loop, track_seconds, stats):
+        self.guild = guild
+        self.loop = loop
+        self.track_seconds = track_seconds
+        self.stats = stats
+        self.source = None
+        self.after = None
+        self.connected = True
+        self.paused = False
+        self._timer = None
+        self._ended = None  # (instante, motivo) del final de la última canción
+
+    def is_connected(self):
+        return self.connected
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.paused
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def play(self, source, after=None):
+        # Los mismos errores que discord.VoiceClient.play
+        if not self.connected:
+            raise RuntimeError("Not connected to voice.")
+        if self.source is not None:
+            raise RuntimeError("Already playing audio.")
+        now = time.perf_counter()
+        if self._ended is not None:
+            ended_at, reason = self._ended
+            self.stats.gaps[reason].append(now - ended_at)
+            self._ended = None
+        self.source, self.after = source, after
+        self.stats.tracks += 1
+        self._timer = self.loop.call_later(self.track_seconds, self._finish, "end")
+
+    def stop(self):
+        self._finish("skip")
+
+    def _finish(self, reason):
+        if self.source is None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        after, self.source, self.after, self._timer = self.after, None, None, None
+        self._ended = (time.perf_counter(), reason)
+        if after:
+            after(None)
+
+    async def disconnect(self, force=False):
+        if not self.connected:
+            return
+        self.connected = False
+        self._finish("disconnect")
+        self._ended = None  # Lo que suene después de reconectar no cuenta como hueco
+        self.guild.voice_client = None
+        self.guild.bot.dispatch_voice_leave(self.guild)
+
+
+class SimGuild:
+    def __init__(self, guild_id, bot, loop, track_seconds, stats):
+        self.id = guild_id
+        self.bot = bot
+        self.voice_client = None
+        self.channel = types.SimpleNamespace(connect=self._connect)
+        self._loop = loop
+        self._track_seconds = track_seconds
+        self._stats = stats
+
+    async def _connect(self):
+        self.voice_client = SimVoiceClient(self, self._loop, self._track_seconds, self._stats)
+        return self.voice_client
+
+
+class SimResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send_message(self, content=None, ephemeral=False, **kwargs):
+        self.interaction.responded_at = time.perf_counter()
+        self.interaction.message.content = content
+        self.interaction.ephemeral = ephemeral
+
+
+class SimInteraction:
+    def __init__(self, guild, user_id):
+        self.guild = guild
+        self.user = types.SimpleNamespace(
+            id=user_id, name=f"usuario{user_id}", voice=types.SimpleNamespace(channel=guild.channel)
+        )
+        self.message = FakeMessage()
+        self.response = SimResponse(self)
+        self.responded_at = None
+        self.ephemeral = False
+
+    async def original_response(self):
+        return self.message
+
+
+class SimBot(FakeBot):
+    """Bot falso que además avisa a los listeners cuando el bot sale de un canal de voz."""
+    def __init__(self):
+        super().__init__()
+        self.listeners = []
+
+    def add_listener(self, func, name=None):
+        self.listeners.append(func)
+
+    def dispatch_voice_leave(self, guild):
+        member = types.SimpleNamespace(id=self.user.id, guild=guild)
+        before = types.SimpleNamespace(channel=guild.channel)
+        after = types.SimpleNamespace(channel=None)
+        for listener in self.listeners:
+            asyncio.ensure_future(listener(member, before, after))
+
+
+class Stats:
+    def __init__(self):
+        self.loop_lag = []
+        self.gaps = defaultdict(list)  # motivo ('end' o 'skip') -> huecos en segundos
+        self.response = defaultdict(list)  # comando -> segundos hasta la primera respuesta
+        self.duration = defaultdict(list)  # comando -> segundos hasta que termina el handler
+        self.commands = Counter()
+        self.rejected = Counter()  # Respuestas efímeras del control de admisión
+        self.errors = Counter()  # tipo -> cuántos
+        self.error_samples = {}
+        self.tracks = 0
+        self.replies = []  # (comando, mensaje): el texto final se revisa al acabar
+
+
+    def error(self, kind, detail):
+        self.errors[kind] += 1
+        self.error_samples.setdefault(kind, detail)
+
+
+def percentiles(values):
+    if not values:
+        return {"n": 0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+    return {"n": len(values), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": values[-1]}
+
+
+def format_ms(summary):
+    if not summary["n"]:
+        return "sin datos"
+    return (f"n={summary['n']:<6} p50 {summary['p50'] * 1000:7.1f}ms  p95 {summary['p95'] * 1000:7.1f}ms  "
+            f"p99 {summary['p99'] * 1000:7.1f}ms  máx {summary['max'] * 1000:7.1f}ms")
+
+
+async def monitor_loop_lag(stats, interval=0.01):
+    """Mide cuánto tarda de más en despertar un sleep corto: el retraso del bucle de eventos."""
+    loop = asyncio.get_running_loop()
+    while True:
+        before = loop.time()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(max(0.0, loop.time() - before - interval))
+
+
+def pick_command(rng):
+    roll = rng.random()
+    if roll < 0.55:
+        return "play"
+    if roll < 0.80:
+        return "skip"
+    if roll < 0.92:
+        return "shuffle"
+    return "stop"
+
+
+def play_query(rng, args):
+    roll = rng.random()
+    if roll < args.playlist_share:
+        return f"https://www.youtube.com/playlist?list=LT{rng.randrange(args.playlists)}"
+    if roll < args.playlist_share + 0.25:
+        return f"canción de prueba {rng.randrange(args.catalog)}"
+    return f"https://www.youtube.com/watch?v=t{rng.randrange(args.catalog):010d}"
+
+
+async def run_command(commands, stats, name, interaction, *params):
+    start = time.perf_counter()
+    stats.commands[name] += 1
+    try:
+        await commands[name].callback(interaction, *params)
+    except Exception as e:
+        stats.error(f"excepción en /{name}", f"{type(e).__name__}: {e}")
+        return
+    end = time.perf_counter()
+    stats.duration[name].append(end - start)
+    if interaction.responded_at is not None:
+        stats.response[name].append(interaction.responded_at - start)
+    if interaction.ephemeral:
+        stats.rejected[name] += 1
+    else:
+        stats.replies.append((name, interaction.message))
+
+
+async def drive_guild(commands, guild, rng, args, stats, deadline, tasks):
+    """Un servidor: varios usuarios lanzando comandos con pausas aleatorias hasta `deadline`.
+
+    Los comandos en curso quedan en `tasks`; quien llama los espera aparte.
+    """
+    loop = asyncio.get_running_loop()
+    users = [guild.id * 100 + n for n in range(args.users)]
+    while True:
+        # Sin pasarse del final: la carga dura exactamente --duration
+        await asyncio.sleep(min(rng.expovariate(1 / args.think), max(0.0, deadline - loop.time())))
+        if loop.time() >= deadline:
+            return
+        name = pick_command(rng)
+        interaction = SimInteraction(guild, rng.choice(users))
+        params = (play_query(rng, args),) if name == "play" else ()
+        # Los comandos no se esperan entre sí: como en Discord, pueden solaparse
+        task = asyncio.create_task(run_command(commands, stats, name, interaction, *params))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+async def run(args):
+    install_stub_yt_dlp()
+    LoadTestYoutubeDL.latency = args.latency_ms / 1000
+    LoadTestYoutubeDL.jitter = args.jitter
+    LoadTestYoutubeDL.fail_rate = args.fail_rate
+    LoadTestYoutubeDL.playlist_size = args.playlist_size
+    sys.modules["yt_dlp"].YoutubeDL = LoadTestYoutubeDL
+
+    import commands_music
+    from admission import AdmissionControl
+    from metrics import metrics
+
+    stats = Stats()
+    loop = asyncio.get_running_loop()
+
+    # Los errores en segundo plano (process_downloads, play_next...) solo se imprimen: se cuentan
+    def capture_print(*values, **kwargs):
+        text = " ".join(str(value) for value in values)
+        if args.verbose:
+            print(text, **kwargs)
+        if "rror" in text:
+            stats.error(text.split(":", 1)[0][:60], text)
+    commands_music.print = capture_print
+
+    def exception_handler(loop, context):
+        stats.error("excepción sin capturar en una tarea", context.get("message", ""))
+    loop.set_exception_handler(exception_handler)
+
+    async def fake_create_source(url, codec=None, before_options=''):
+        if args.ffmpeg_ms:
+            await asyncio.sleep(args.ffmpeg_ms / 1000)
+        return FakeSource(url)
+    commands_music.create_source = fake_create_source
+    commands_music.PLAYLIST_MODE = args.playlist_mode
+    if not args.admission:
+        commands_music.admission = AdmissionControl()  # Sin límites: se mide el sistema, no los límites
+
+    bot = SimBot()
+    commands_music.setup_music_commands(bot)
+    commands = bot.tree.commands
+    guilds = [SimGuild(1000 + n, bot, loop, args.track_seconds, stats) for n in range(args.guilds)]
+
+    print(f"{args.guilds} servidores × {args.users} usuarios durante {args.duration:g}s "
+          f"(yt_dlp {args.latency_ms:g}ms, canciones de {args.track_seconds:g}s, playlists {args.playlist_mode})...")
+    monitor = asyncio.create_task(monitor_loop_lag(stats))
+    rng = random.Random(args.seed)
+    deadline = loop.time() + args.duration
+    started = time.perf_counter()
+    in_flight = set()
+    await asyncio.gather(*(
+        drive_guild(commands, guild, random.Random(rng.random()), args, stats, deadline, in_flight)
+        for guild in guilds
+    ))
+    elapsed = time.perf_counter() - started
+    # Los comandos lanzados antes del final terminan fuera del tiempo de carga
+    if in_flight:
+        await asyncio.wait(set(in_flight))
+    drain = time.perf_counter() - started - elapsed
+
+    # Limpieza: /stop en todos los servidores para cancelar descargas y playlists pendientes
+    for guild in guilds:
+        await commands["stop"].callback(SimInteraction(guild, 0))
+    # Los mensajes de progreso de /play se editan aparte, como mucho cada PROGRESS_INTERVAL
+    await asyncio.sleep(commands_music.PROGRESS_INTERVAL + 0.1)
+    monitor.cancel()
+    commands_music.extraction_pool.shutdown()
+    for name, message in stats.replies:
+        if (message.content or "").startswith("Error"):
+            stats.error(f"/{name} respondió con error", message.content)
+
+    report = {
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "drain_s": drain,
+        "commands": dict(stats.commands),
+        "rejected": dict(stats.rejected),
+        "tracks_played": stats.tracks,
+        "extract_info_calls": LoadTestYoutubeDL.calls,
+        "loop_lag": percentiles(stats.loop_lag),
+        "track_gap": {reason: percentiles(values) for reason, values in stats.gaps.items()},
+        "response": {name: percentiles(values) for name, values in stats.response.items()},
+        "duration": {name: percentiles(values) for name, values in stats.duration.items()},
+        "errors": dict(stats.errors),
+        "error_samples": stats.error_samples,
+        "metrics_track_gap": {
+            preopened: {"n": n, "p50": p50, "p99": p99}
+            for preopened, (n, p50, p99) in metrics.summary("track_gap_seconds", "preopened").items()
+        },
+    }
+    return report
+
+
+def print_report(report):
+    total = sum(report["commands"].values())
+    print(f"\n{total} comandos en {report['elapsed_s']:.1f}s ({total / report['elapsed_s']:.0f}/s): "
+          + ", ".join(f"/{name} {count}" for name, count in sorted(report["commands"].items())))
+    print(f"Los comandos en curso al acabar tardaron {report['drain_s']:.1f}s más en terminar")
+    print(f"{report['tracks_played']} canciones reproducidas, {report['extract_info_calls']} extract_info")
+    if report["rejected"]:
+        print("Rechazados por el control de admisión: "
+              + ", ".join(f"/{name} {count}" for name, count in report["rejected"].items()))
+    print(f"\nRetraso del bucle         {format_ms(report['loop_lag'])}")
+    for reason, label in (("end", "Hueco al acabar canción"), ("skip", "Hueco tras /skip")):
+        print(f"{label:<25} {format_ms(report['track_gap'].get(reason, {'n': 0}))}")
+    print("\nPrimera respuesta por comando:")
+    for name, summary in sorted(report["response"].items()):
+        print(f"  /{name:<22} {format_ms(summary)}")
+    print("Duración del handler:")
+    for name, summary in sorted(report["duration"].items()):
+        print(f"  /{name:<22} {format_ms(summary)}")
+    if report["errors"]:
+        print("\nErrores:")
+        for kind, count in sorted(report["errors"].items(), key=lambda item: -item[1]):
+            print(f"  {count:>5}  {kind}  (p. ej. {report['error_samples'][kind][:120]!r})")
+    else:
+        print("\nSin errores.")
+
+
+def check_thresholds(report, args):
+    """Devuelve la lista de umbrales superados."""
+    failures = []
+    lag = report["loop_lag"]
+    if lag["n"] and lag["p99"] * 1000 > args.max_lag_ms:
+        failures.append(f"retraso del bucle p99 {lag['p99'] * 1000:.1f}ms > {args.max_lag_ms:g}ms")
+    for reason, summary in report["track_gap"].items():
+        if summary["n"] and summary["p99"] * 1000 > args.max_gap_ms:
+            failures.append(f"hueco entre canciones ({reason}) p99 {summary['p99'] * 1000:.1f}ms > {args.max_gap_ms:g}ms")
+    errors = sum(report["errors"].values())
+    if errors > args.max_errors:
+        failures.append(f"{errors} errores > {args.max_errors}")
+    if not report["tracks_played"]:
+        failures.append("no sonó ninguna canción")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=50, help="servidores simulados")
+    parser.add_argument("--users", type=int, default=3, help="usuarios por servidor")
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos de carga")
+    parser.add_argument("--think", type=float, default=5.0, help="segundos medios entre comandos de un servidor")
+    parser.add_argument("--track-seconds", type=float, default=3.0, help="duración de cada canción simulada")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="latencia de cada extract_info falso")
+    parser.add_argument("--jitter", type=float, default=0.5, help="variación de esa latencia (0.5 = ±50%%)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="proporción de extracciones que fallan")
+    parser.add_argument("--ffmpeg-ms", type=float, default=20.0, help="lo que tarda en abrirse cada fuente de audio")
+    parser.add_argument("--catalog", type=int, default=2000, help="vídeos distintos que se piden")
+    parser.add_argument("--playlists", type=int, default=20, help="playlists distintas que se piden")
+    parser.add_argument("--playlist-size", type=int, default=50, help="canciones por playlist")
+    parser.add_argument("--playlist-share", type=float, default=0.1, help="proporción de /play que son playlists")
+    parser.add_argument("--playlist-mode", choices=("jit", "resolve"), default="jit")
+    parser.add_argument("--admission", action="store_true", help="aplica los límites de MUSIC_USER_REQUESTS y compañía")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-lag-ms", type=float, default=100.0, help="umbral del p99 del retraso del bucle")
+    parser.add_argument("--max-gap-ms", type=float, default=1000.0, help="umbral del p99 del hueco entre canciones")
+    parser.add_argument("--max-errors", type=int, default=0, help="errores permitidos")
+    parser.add_argument("--output", help="guarda el informe en JSON")
+    parser.add_argument("--verbose", action="store_true", help="muestra los mensajes del bot")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    failures = check_thresholds(report, args)
+    report["failures"] = failures
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"\nInforme guardado en {args.output}")
+    if failures:
+        print("\nFALLA: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nOK: dentro de los umbrales.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Tuple
+
+# Límites de los buckets en segundos, como los de Prometheus por defecto pero hasta 30 s
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+
+class Histogram:
+    """Histograma de buckets fijos: observar cuesta una búsqueda en 13 límites."""
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimación del cuantil: límite superior del bucket donde cae."""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """Registro de métricas del bot: histogramas de latencia y valores calculados al leer.
+
+    Observar solo suma en un bucket; los valores que ya lleva el bot (tamaño de
+    las colas, aciertos de caché...) no se copian, se leen al exportar.
+    """
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self.gauges: Dict[str, Tuple[Callable[[], dict], str]] = {}
+        self._lock = threading.Lock()  # Las extracciones se miden desde hilos del executor
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_gauge(self, name, collect, kind="gauge"):
+        """Registra un valor que se lee al exportar.
+
+        `collect()` devuelve {etiquetas (tupla de pares): valor}; `kind` es 'gauge'
+        o 'counter' (para contadores que ya lleva otro objeto).
+        """
+        self.gauges[name] = (collect, kind)
+
+    def collect_gauges(self):
+        """Devuelve {nombre: (tipo, {etiquetas: valor})}."""
+        values = {}
+        for name, (collect, kind) in self.gauges.items():
+            try:
+                values[name] = (kind, collect())
+            except Exception as e:
+                print(f"Error calculando la métrica {name}: {str(e)}")
+        return values
+
+    def summary(self, name, by):
+        """Agrupa los histogramas `name` por la etiqueta `by`: {valor: (n, p50, p99)}."""
+        merged = {}
+        with self._lock:
+            for (metric, labels), histogram in self.histograms.items():
+                if metric != name:
+                    continue
+                key = dict(labels).get(by, "")
+                total = merged.setdefault(key, Histogram())
+                total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+                total.sum += histogram.sum
+                total.count += histogram.count
+        return {key: (h.count, h.quantile(0.5), h.quantile(0.99)) for key, h in sorted(merged.items())}
+
+    def render_prometheus(self):
+        """Devuelve todas las métricas en el formato de texto de Prometheus."""
+        with self._lock:
+            snapshot = [(name, labels, list(h.counts), h.sum, h.count) for (name, labels), h in self.histograms.items()]
+        lines = []
+        typed = set()
+        for name, labels, counts, total, count in sorted(snapshot):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, counts):
+                cumulative += bucket
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for name, (kind, values) in sorted(self.collect_gauges().items()):
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
+
+
+def timed_command(func):
+    """Decorador para comandos slash: mide su latencia con la etiqueta command=<nombre>.
+
+    Va debajo de @bot.tree.command; functools.wraps conserva la firma, que es
+    de donde discord.py saca los parámetros del comando.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            metrics.observe("command_latency_seconds", time.perf_counter() - start, command=func.__name__, status=status)
+    return wrapper
+
+
+async def _serve_http(reader, writer):
+    try:
+        await reader.readline()  # Solo hay una ruta: cualquier petición devuelve las métricas
+        body = metrics.render_prometheus().encode()
+        writer.write(
+            b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def _write_file_periodically(path, interval):
+    while True:
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(metrics.render_prometheus())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error escribiendo las métricas en {path}: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+async def start_exporter():
+    """Publica las métricas si se configuró METRICS_PORT (HTTP local) o METRICS_FILE."""
+    port = os.getenv("METRICS_PORT")
+    if port:
+        await asyncio.start_server(_serve_http, host=os.getenv("METRICS_HOST", "127.0.0.1"), port=int(port))
+        print(f"Métricas disponibles en http://{os.getenv('METRICS_HOST', '127.0.0.1')}:{port}/metrics")
+    path = os.getenv("METRICS_FILE")
+    if path:
+        asyncio.create_task(_write_file_periodically(path, float(os.getenv("METRICS_FILE_SECONDS", "15"))))
@@ -0,0 +1,317 @@
+import bisect
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+# Ids de YouTube en enlaces del tipo watch?v=ID, youtu.be/ID o shorts/ID
+VIDEO_ID_PATTERN = re.compile(r"(?:v=|youtu\.be/|shorts/)([A-Za-z0-9_-]{11})")
+
+
+def parse_video_id(url: str) -> Optional[str]:
+    """Extrae el id de vídeo de un enlace de YouTube sin llamar a yt_dlp.
+
+    Con `list=` devuelve None aunque lleve `v=`: yt_dlp trata ese enlace como
+    la playlist entera, y el atajo no debe cambiar lo que se encola.
+    """
+    if "list" in parse_qs(urlparse(url).query):
+        return None
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def parse_expiry(url: str, default_ttl: float) -> float:
+    """Devuelve el instante (epoch) en que caduca una URL de streaming.
+
+    Las URLs de googlevideo llevan el parámetro `expire`, en la query o como
+    segmento `/expire/<ts>/` en los manifiestos. Si no aparece se usa default_ttl.
+    """
+    parsed = urlparse(url)
+    expire = parse_qs(parsed.query).get("expire")
+    if expire and expire[0].isdigit():
+        return float(expire[0])
+    match = re.search(r"/expire/(\d+)", parsed.path)
+    if match:
+        return float(match.group(1))
+    return time.time() + default_ttl
+
+
+class StreamCache:
+    """Caché LRU de título, duración y URL de streaming por id de vídeo.
+
+    Una entrada deja de servirse cuando su URL está a menos de `margin` segundos
+    de caducar. Si se indica `path`, las entradas vigentes se guardan en disco
+    y se vuelven a cargar al arrancar.
+    """
+    def __init__(self, max_entries=1000, path=None, margin=600, default_ttl=1800):
+        self.entries = OrderedDict()  # video_id -> {'title', 'duration', 'url', 'webpage_url', 'acodec', 'expires'}
+        self.max_entries = max_entries
+        self.path = path
+        self.margin = margin
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, video_id):
+        """Indica si hay una entrada vigente, sin contarla como acierto ni fallo."""
+        entry = self.entries.get(video_id)
+        return entry is not None and self.is_fresh(entry)
+
+    def is_fresh(self, entry) -> bool:
+        return entry['expires'] - self.margin > time.time()
+
+    def get(self, video_id) -> Optional[dict]:
+        """Devuelve la entrada si su URL sigue vigente, marcándola como usada."""
+        entry = self.entries.get(video_id)
+        if entry is None or not self.is_fresh(entry):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(video_id)
+        self.hits += 1
+        return entry
+
+    def put(self, video_id, info) -> dict:
+        """Guarda la información extraída por yt_dlp y expulsa la menos usada si hace falta."""
+        url = info.get('url')
+        entry = {
+            'title': info.get('title', 'Unknown Title'),
+            'duration': info.get('duration'),
+            'url': url,
+            'webpage_url': info.get('webpage_url'),
+            'acodec': info.get('acodec'),
+            'expires': parse_expiry(url, self.default_ttl) if url else 0,
+        }
+        self.entries[video_id] = entry
+        self.entries.move_to_end(video_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._dirty = True
+        return entry
+
+    def invalidate(self, video_id):
+        if self.entries.pop(video_id, None) is not None:
+            self._dirty = True
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error cargando la caché de streams: {str(e)}")
+            return
+        # El archivo se guarda de menos a más reciente, así se conserva el orden LRU
+        for video_id, entry in stored.items():
+            if self.is_fresh(entry):
+                self.entries[video_id] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        """Escribe las entradas vigentes en disco si hubo cambios desde la última vez."""
+        if not self.path or not self._dirty:
+            return
+        fresh = {video_id: entry for video_id, entry in self.entries.items() if self.is_fresh(entry)}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(fresh, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+class AudioCache:
+    """Caché en disco del audio descargado, con un límite de bytes y expulsión LRU.
+
+    Cada archivo se llama como el id del vídeo. El orden de uso se guarda en la
+    fecha de modificación de los archivos, así sobrevive a los reinicios.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()  # video_id -> (ruta, tamaño), de menos a más reciente
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            video_id, ext = os.path.splitext(name)
+            if not os.path.isfile(path) or ext in (".part", ".ytdl", ".tmp"):
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, video_id, path, stat.st_size))
+        for _, video_id, path, size in sorted(found):
+            self.files[video_id] = (path, size)
+            self.total_bytes += size
+        self._evict()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, video_id):
+        return video_id in self.files
+
+    def output_template(self, video_id):
+        """Plantilla de nombre para el `outtmpl` de yt_dlp."""
+        return os.path.join(self.directory, f"{video_id}.%(ext)s")
+
+    def get(self, video_id) -> Optional[str]:
+        """Devuelve la ruta del audio si está en caché, marcándolo como usado."""
+        cached = self.files.get(video_id)
+        if cached is None or not os.path.exists(cached[0]):
+            if cached is not None:
+                self._forget(video_id)
+            self.misses += 1
+            return None
+        self.files.move_to_end(video_id)
+        try:
+            os.utime(cached[0])
+        except OSError:
+            pass
+        self.hits += 1
+        return cached[0]
+
+    def add(self, video_id, path):
+        """Registra un archivo ya descargado en el directorio de la caché."""
+        if video_id in self.files:
+            self._forget(video_id)
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            os.remove(path)
+            return
+        self.files[video_id] = (path, size)
+        self.total_bytes += size
+        self._evict()
+
+    def _forget(self, video_id):
+        _, size = self.files.pop(video_id)
+        self.total_bytes -= size
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.files:
+            video_id, (path, size) = next(iter(self.files.items()))
+            self._forget(video_id)
+            try:
+                os.remove(path)
+            except OSError as e:
+                # En Windows no se puede borrar un archivo que se está reproduciendo
+                print(f"No se pudo borrar {path} de la caché de audio: {str(e)}")
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas y espacios simples, para comparar búsquedas y títulos."""
+    return " ".join(text.casefold().split())
+
+
+class SearchCache:
+    """Caché con caducidad de búsqueda normalizada -> id del primer resultado.
+
+    Solo guarda el id: título y URL de streaming salen de StreamCache, que ya
+    sabe cuándo caduca cada URL.
+    """
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.entries = OrderedDict()  # búsqueda normalizada -> (video_id, expires)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, query) -> Optional[str]:
+        key = normalize_text(query)
+        cached = self.entries.get(key)
+        if cached is None or cached[1] < time.time():
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return cached[0]
+
+    def put(self, query, video_id):
+        key = normalize_text(query)
+        self.entries[key] = (video_id, time.time() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class TitleIndex:
+    """Índice de prefijos sobre los títulos ya reproducidos, para autocompletar /play.
+
+    Guarda una clave por cada palabra del título (el título a partir de esa
+    palabra) en una lista ordenada: buscar es una búsqueda binaria más un
+    recorrido de las coincidencias, así "never gonna" encuentra
+    "Rick Astley - Never Gonna Give You Up".
+    """
+    max_words = 8  # Palabras por título desde las que se puede empezar a escribir
+
+    def __init__(self, max_entries=5000):
+        self.titles = OrderedDict()  # video_id -> título, de más antiguo a más reciente
+        self.max_entries = max_entries
+        self._keys = []  # (texto normalizado desde una palabra, video_id), ordenadas
+        self.page_urls = {}  # video_id -> página, solo de lo que no es de YouTube
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, video_id):
+        return video_id in self.titles
+
+    def _title_keys(self, video_id, title):
+        words = normalize_text(title).split(" ")
+        return {(" ".join(words[i:]), video_id) for i in range(min(len(words), self.max_words))}
+
+    def add(self, video_id, title, url=None):
+        """Indexa un título; `url` es su página, que solo se guarda si no sale del id de YouTube."""
+        if not title:
+            return
+        if video_id in self.titles:
+            self.titles.move_to_end(video_id)
+            return
+        self.titles[video_id] = title
+        if url and parse_video_id(url) != video_id:
+            self.page_urls[video_id] = url
+        for key in self._title_keys(video_id, title):
+            bisect.insort(self._keys, key)
+        while len(self.titles) > self.max_entries:
+            self._discard(*self.titles.popitem(last=False))
+
+    def _discard(self, video_id, title):
+        self.page_urls.pop(video_id, None)
+        for key in self._title_keys(video_id, title):
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+
+    def link(self, video_id):
+        """Enlace con el que /play vuelve a encontrar la canción."""
+        return self.page_urls.get(video_id) or f"https://www.youtube.com/watch?v={video_id}"
+
+    def search(self, prefix, limit=25):
+        """Devuelve (video_id, título) de los títulos con alguna palabra que empiece por `prefix`."""
+        prefix = normalize_text(prefix)
+        if not prefix:
+            return []
+        results = {}
+        i = bisect.bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and len(results) < limit:
+            key, video_id = self._keys[i]
+            if not key.startswith(prefix):
+                break
+            results.setdefault(video_id, self.titles[video_id])
+            i += 1
+        return list(results.items())
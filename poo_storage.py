@@ -0,0 +1,258 @@
+import asyncio
+import bisect
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+EPOCH = "1970-01-01T00:00:00"
+
+
+class JsonPooStorage:
+    """Guarda todos los usuarios en un único archivo JSON (formato original).
+
+    La tabla vive en memoria: /poo solo la modifica y marca que hay cambios.
+    El archivo se reescribe en segundo plano cada cierto tiempo y al cerrar,
+    en un temporal que luego se renombra, así un corte a mitad de escritura
+    no deja el JSON corrupto.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # Protege la tabla en memoria: /poo nunca espera al disco
+        self._file_lock = threading.Lock()  # Un solo volcado a la vez (el periódico y el del cierre)
+        self._dirty = False
+        self._flush_task = None
+        self.flushes = 0
+        self.bytes_written = 0
+        if not Path(path).exists():
+            with open(path, "w") as f:
+                json.dump({"users": {}}, f)
+        self.data = self.load_data()
+
+    def load_data(self):
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def save_data(self, data):
+        payload = json.dumps(data, indent=4).encode()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.flushes += 1
+        self.bytes_written += len(payload)
+
+    def register_use(self, user_id: str, now: datetime, cooldown: timedelta) -> Optional[timedelta]:
+        """Suma un uso si ya pasó el tiempo de espera; si no, devuelve el tiempo que falta."""
+        with self._lock:
+            user = self.data["users"].setdefault(user_id, {"count": 0, "last_used": EPOCH})
+            last_used = datetime.fromisoformat(user["last_used"])
+            if now - last_used < cooldown:
+                return cooldown - (now - last_used)
+            user["count"] += 1
+            user["last_used"] = now.isoformat()
+            self._dirty = True
+            return None
+
+    def ranking(self) -> List[Tuple[str, int]]:
+        """Devuelve (user_id, veces) de todos los usuarios, de más a menos."""
+        with self._lock:
+            counts = [(user_id, info["count"]) for user_id, info in self.data["users"].items()]
+        return sorted(counts, key=lambda x: x[1], reverse=True)
+
+    def flush(self):
+        """Escribe el archivo si hubo cambios desde el último volcado."""
+        # La copia se toma dentro del candado de escritura: un volcado más antiguo
+        # no puede pisar el .tmp de otro ni dejar en su sitio datos más viejos
+        with self._file_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                # Copia superficial por usuario: el volcado no ve cambios a medias
+                snapshot = {"users": {user_id: dict(info) for user_id, info in self.data["users"].items()}}
+                self._dirty = False
+            try:
+                self.save_data(snapshot)
+            except Exception:
+                self._dirty = True
+                raise
+
+    def start(self, interval):
+        """Lanza el volcado periódico; se llama desde el bucle de eventos."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_periodically(interval))
+
+    async def _flush_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"Error guardando {self.path}: {str(e)}")
+
+    def stop(self):
+        """Detiene el volcado periódico; como start, se llama desde el bucle de eventos."""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+
+    def close(self):
+        """Último volcado; puede ir en un hilo aparte, después de stop()."""
+        self.flush()
+
+
+class SqlitePooStorage:
+    """Guarda cada usuario como una fila de SQLite en modo WAL.
+
+    Cada /poo es una sola transacción sobre una fila, sin reescribir el resto,
+    y el ranking usa el índice por número de veces.
+    """
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        # Las llamadas llegan desde hilos del executor; el lock serializa el acceso
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            " user_id TEXT PRIMARY KEY,"
+            " count INTEGER NOT NULL DEFAULT 0,"
+            " last_used TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS users_by_count ON users(count DESC)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if json_path:
+            self._migrate_json(json_path)
+
+    def _migrate_json(self, json_path):
+        """Importa poo_data.json la primera vez que se arranca con SQLite."""
+        done = self.conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done or not os.path.exists(json_path):
+            return
+        with open(json_path, "r") as f:
+            users = json.load(f).get("users", {})
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, count, last_used) VALUES (?, ?, ?)",
+                    ((user_id, info.get("count", 0), info.get("last_used", EPOCH)) for user_id, info in users.items()),
+                )
+                self.conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (json_path,))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        print(f"Migrados {len(users)} usuarios de {json_path} a {self.path}.")
+
+    def register_use(self, user_id: str, now: datetime, cooldown: timedelta) -> Optional[timedelta]:
+        """Suma un uso si ya pasó el tiempo de espera; si no, devuelve el tiempo que falta."""
+        with self._lock:
+            # BEGIN IMMEDIATE toma el bloqueo de escritura antes de leer: dos /poo
+            # simultáneos (incluso desde otro proceso) no pueden pisarse
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT last_used FROM users WHERE user_id = ?", (user_id,)).fetchone()
+                if row:
+                    last_used = datetime.fromisoformat(row[0])
+                    if now - last_used < cooldown:
+                        self.conn.execute("ROLLBACK")
+                        return cooldown - (now - last_used)
+                self.conn.execute(
+                    "INSERT INTO users (user_id, count, last_used) VALUES (?, 1, ?)"
+                    " ON CONFLICT(user_id) DO UPDATE SET count = count + 1, last_used = excluded.last_used",
+                    (user_id, now.isoformat()),
+                )
+                self.conn.execute("COMMIT")
+                return None
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def ranking(self) -> List[Tuple[str, int]]:
+        """Devuelve (user_id, veces) de todos los usuarios, de más a menos."""
+        with self._lock:
+            return self.conn.execute("SELECT user_id, count FROM users ORDER BY count DESC").fetchall()
+
+    def ranking_page(self, start, stop, user_id):
+        """Una página del ranking leída con el índice por veces, sin cargar a todos los usuarios.
+
+        Devuelve (usuarios en total, [(user_id, veces)] de start..stop, (posición,
+        veces) de user_id o None). Los empates se ordenan por user_id, como en RankingIndex.
+        """
+        with self._lock:
+            total = self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT user_id, count FROM users ORDER BY count DESC, user_id LIMIT ? OFFSET ?",
+                (stop - start, start),
+            ).fetchall()
+            row = self.conn.execute("SELECT count FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            mine = None
+            if row:
+                ahead = self.conn.execute(
+                    "SELECT (SELECT COUNT(*) FROM users WHERE count > ?)"
+                    " + (SELECT COUNT(*) FROM users WHERE count = ? AND user_id < ?)",
+                    (row[0], row[0], user_id),
+                ).fetchone()[0]
+                mine = (ahead + 1, row[0])
+        return total, rows, mine
+
+    def flush(self):
+        pass  # Cada transacción ya queda en disco
+
+    def start(self, interval):
+        pass
+
+    def stop(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class RankingIndex:
+    """Ranking de /poo ordenado en memoria y actualizado con cada uso.
+
+    Guarda claves (-veces, user_id) ordenadas, así el top-N es un corte de la
+    lista y la posición de un usuario una búsqueda binaria, sin volver a leer
+    ni ordenar todos los usuarios en cada /ranking.
+    """
+    def __init__(self, counts=()):
+        self.counts = dict(counts)
+        self._keys = sorted((-count, user_id) for user_id, count in self.counts.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def increment(self, user_id, amount=1):
+        old = self.counts.get(user_id)
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, user_id))]
+        self.counts[user_id] = (old or 0) + amount
+        bisect.insort(self._keys, (-self.counts[user_id], user_id))
+
+    def page(self, start, stop) -> List[Tuple[str, int]]:
+        """Devuelve (user_id, veces) de las posiciones start..stop (empezando en 0)."""
+        return [(user_id, -count) for count, user_id in self._keys[start:stop]]
+
+    def position(self, user_id) -> Optional[int]:
+        """Posición del usuario en el ranking (empezando en 1), o None si no aparece."""
+        count = self.counts.get(user_id)
+        if count is None:
+            return None
+        return bisect.bisect_left(self._keys, (-count, user_id)) + 1
+
+
+def open_storage(kind, json_path, db_path):
+    """Crea el almacenamiento indicado: 'sqlite' (por defecto) o 'json'."""
+    if kind == "json":
+        return JsonPooStorage(json_path)
+    if kind == "sqlite":
+        return SqlitePooStorage(db_path, json_path=json_path)
+    raise ValueError(f"Tipo de almacenamiento desconocido: {kind}")
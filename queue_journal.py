@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+from collections import deque
+from typing import Optional
+
+
+class QueueJournal:
+    """Diario en disco de la cola de un servidor, en JSON Lines.
+
+    Cada cambio de la cola (añadir, sacar la siguiente, quitar) es una línea
+    que se añade al final del archivo. Solo se reescribe entero al compactar:
+    tras un shuffle o cuando el diario ya es mucho más largo que la cola que
+    describe. Las líneas se acumulan en memoria y flush() las escribe juntas,
+    fuera del bucle de eventos. Una línea cortada por una caída se ignora.
+
+    Las canciones se guardan como listas [id, título, video_id, añadido_por,
+    url, marca de shuffle, id de usuario, página] (ver Song.to_record).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lines = 0  # Líneas del archivo en disco
+        self._pending = []  # Líneas aún sin escribir
+        self._rewrite = None  # Snapshot que sustituirá al archivo en el próximo flush
+        self._needs_rewrite = False
+        self._lock = threading.Lock()  # Protege las listas en memoria: el bucle nunca espera al disco
+        self._file_lock = threading.Lock()
+
+    @staticmethod
+    def _encode(record):
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+    def record(self, op, **fields):
+        line = self._encode(dict(op=op, **fields))
+        with self._lock:
+            self._pending.append(line)
+
+    def replace_with(self, snapshot):
+        """Programa la compactación: el próximo flush deja solo este snapshot y lo posterior."""
+        line = self._encode(dict(snapshot, op="snapshot"))
+        with self._lock:
+            self._rewrite = line
+            self._pending = []
+            self._needs_rewrite = False
+
+    def has_pending(self):
+        """Si el próximo flush tiene algo que escribir."""
+        with self._lock:
+            return self._rewrite is not None or bool(self._pending)
+
+    def needs_compaction(self, queue_length):
+        if self._needs_rewrite:
+            return True
+        return self._rewrite is None and self.lines + len(self._pending) > max(1000, 4 * queue_length)
+
+    def flush(self):
+        """Escribe lo pendiente: añadiendo al final o, si toca compactar, reescribiendo el archivo."""
+        with self._file_lock:
+            with self._lock:
+                rewrite, pending = self._rewrite, self._pending
+                self._rewrite, self._pending = None, []
+            try:
+                if rewrite is not None:
+                    tmp_path = f"{self.path}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write("\n".join([rewrite] + pending) + "\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, self.path)
+                    self.lines = 1 + len(pending)
+                elif pending:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write("\n".join(pending) + "\n")
+                    self.lines += len(pending)
+            except Exception:
+                # Lo que no llegó al disco se recupera con un snapshot completo la próxima vez
+                self._needs_rewrite = True
+                raise
+
+    def delete(self):
+        """Borra el diario (al hacer /stop o cuando el bot sale del canal).
+
+        Espera a que acabe un flush en curso: se llama fuera del bucle de eventos.
+        """
+        with self._file_lock:
+            with self._lock:
+                self._rewrite, self._pending = None, []
+            self.lines = 0
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def load(self) -> Optional[dict]:
+        """Reconstruye el estado guardado con la misma forma que un snapshot, o None si no hay diario."""
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        songs, order, current, next_id, shuffle = {}, deque(), None, 0, False
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Línea a medio escribir cuando se cayó el bot
+                op = record.get("op")
+                if op == "snapshot":
+                    songs = {song[0]: song for song in record["songs"]}
+                    order = deque(song[0] for song in record["songs"])
+                    current, next_id, shuffle = record["current"], record["next_id"], record["shuffle"]
+                elif op == "add":
+                    song = record["song"]
+                    songs[song[0]] = song
+                    if record.get("at") is None:
+                        order.append(song[0])
+                    else:
+                        order.insert(record["at"], song[0])
+                    next_id = max(next_id, song[0] + 1)
+                elif op == "pop":
+                    current = songs.pop(order.popleft()) if order else None
+                elif op == "del" and record["id"] in songs:
+                    del songs[record["id"]]
+                    order.remove(record["id"])
+        return {"songs": [songs[song_id] for song_id in order], "current": current, "next_id": next_id, "shuffle": shuffle}
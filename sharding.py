@@ -0,0 +1,333 @@
+"""Despliegue por shards en varios procesos.
+
+Cada proceso ejecuta bot.py con un rango de shards (BOT_SHARD_IDS de un total
+de BOT_SHARD_COUNT), así el tráfico del gateway, yt_dlp y la codificación de
+audio de cada grupo de servidores usan su propio núcleo. El lanzador arranca
+los procesos, los reinicia si se caen o dejan de informar y muestra el
+estado que cada uno escribe en su archivo de salud.
+
+Uso:
+    python sharding.py --workers 4                         # shards recomendados por Discord
+    python sharding.py --workers 2 --shards 8
+    python sharding.py --workers 2 --shards 4 --fake-gateway --guilds 200   # sin Discord
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+import urllib.request
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+DISCORD_API = "https://discord.com/api/v10"
+
+
+def parse_shard_ids(text):
+    """'0,1,2' o '0-2' -> [0, 1, 2]; cadena vacía -> None (todos los shards)."""
+    shard_ids = []
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            shard_ids.extend(range(int(first), int(last) + 1))
+        else:
+            shard_ids.append(int(part))
+    return shard_ids or None
+
+
+def shard_ranges(shard_count, workers):
+    """Reparte los shards 0..shard_count-1 en `workers` rangos consecutivos lo más iguales posible."""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for index in range(workers):
+        stop = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, stop)))
+        start = stop
+    return ranges
+
+
+def format_shards(shard_ids):
+    if not shard_ids:
+        return "-"
+    if shard_ids == list(range(shard_ids[0], shard_ids[-1] + 1)) and len(shard_ids) > 1:
+        return f"{shard_ids[0]}-{shard_ids[-1]}"
+    return ",".join(map(str, shard_ids))
+
+
+def use_fake_gateway(url):
+    """Apunta discord.py a una pasarela local (fake_gateway.py) en vez de a Discord."""
+    import discord.http
+    import yarl
+    from discord.gateway import DiscordWebSocket
+    url = url.rstrip("/")
+    discord.http.Route.BASE = f"{url}/api/v10"
+    DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(url.replace("http", "ws", 1) + "/gateway")
+
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def health_snapshot(bot, loop_lag):
+    from metrics import metrics
+    depths = metrics.collect_gauges().get("music_queue_depth", ("gauge", {}))[1]
+    return {
+        "worker": os.getenv("BOT_WORKER"),
+        "pid": os.getpid(),
+        "time": time.time(),
+        "ready": bot.is_ready(),
+        "shards": {
+            str(shard_id): {
+                "latency": shard.latency if shard.latency == shard.latency else None,  # NaN antes del primer heartbeat
+                "closed": shard.is_closed(),
+            }
+            for shard_id, shard in sorted(bot.shards.items())
+        },
+        "guilds": len(bot.guilds),
+        "voice_clients": len(bot.voice_clients),
+        "queued_songs": sum(depths.values()),
+        "loop_lag": loop_lag,
+    }
+
+
+async def report_health(bot, path, interval=5.0):
+    """Escribe cada `interval` segundos el estado del proceso en `path` (JSON).
+
+    También mide el retraso del bucle de eventos: lo que tarda de más en
+    despertar un sleep. Si sube, el proceso está saturado.
+    """
+    from metrics import metrics
+    loop = asyncio.get_running_loop()
+    lag = 0.0
+    while not bot.is_closed():
+        try:
+            await asyncio.to_thread(write_json_atomic, path, health_snapshot(bot, lag))
+        except OSError as e:
+            print(f"No se pudo escribir {path}: {str(e)}")
+        before = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - before - interval)
+        metrics.observe("event_loop_lag_seconds", lag)
+
+
+def recommended_shards(token, api=DISCORD_API):
+    """Número de shards que recomienda Discord para este bot."""
+    request = urllib.request.Request(f"{api}/gateway/bot", headers={
+        "Authorization": f"Bot {token}",
+        "User-Agent": "DiscordBot (monkebot, 1.0)",
+    })
+    with urllib.request.urlopen(request, timeout=15) as response:
+        return json.load(response)["shards"]
+
+
+class Worker:
+    def __init__(self, index, shard_ids, health_file):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.health_file = health_file
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0  # Reinicios seguidos, para espaciar los siguientes
+        self.restart_at = None
+
+    def read_health(self):
+        try:
+            with open(self.health_file, "r", encoding="utf-8") as f:
+                health = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Un archivo de una ejecución anterior no cuenta
+        return health if self.process and health.get("pid") == self.process.pid else None
+
+
+class Launcher:
+    """Arranca un proceso de bot.py por rango de shards y los vigila."""
+    def __init__(self, shard_count, workers, health_dir, env=None, health_interval=5.0, report_interval=30.0):
+        self.shard_count = shard_count
+        self.health_interval = health_interval
+        self.report_interval = report_interval
+        self.stale_after = max(30.0, 6 * health_interval)
+        self.env = dict(os.environ if env is None else env)
+        os.makedirs(health_dir, exist_ok=True)
+        self.workers = [
+            Worker(index, shard_ids, os.path.join(health_dir, f"worker-{index}.json"))
+            for index, shard_ids in enumerate(shard_ranges(shard_count, workers))
+        ]
+        self._stopping = asyncio.Event()
+
+    def worker_env(self, worker):
+        env = dict(self.env)
+        env.update(
+            BOT_WORKER=str(worker.index),
+            BOT_SHARD_IDS=",".join(map(str, worker.shard_ids)),
+            BOT_SHARD_COUNT=str(self.shard_count),
+            BOT_HEALTH_FILE=worker.health_file,
+            BOT_HEALTH_SECONDS=str(self.health_interval),
+            # Los comandos son globales: basta con que los sincronice un proceso
+            BOT_SYNC_COMMANDS=self.env.get("BOT_SYNC_COMMANDS", "1") if worker.index == 0 else "0",
+        )
+        # Lo que no se puede compartir entre procesos lleva el número del proceso
+        if env.get("METRICS_PORT"):
+            env["METRICS_PORT"] = str(int(env["METRICS_PORT"]) + worker.index)
+        for name in ("METRICS_FILE", "MUSIC_CACHE_FILE"):
+            if env.get(name):
+                root, ext = os.path.splitext(env[name])
+                env[name] = f"{root}.{worker.index}{ext}"
+        return env
+
+    async def start_worker(self, worker):
+        worker.process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=self.worker_env(worker))
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        print(f"[worker {worker.index}] pid {worker.process.pid} · shards {format_shards(worker.shard_ids)} de {self.shard_count}")
+
+    def check(self, worker, now):
+        """Programa el reinicio de un proceso caído y mata al que dejó de informar."""
+        process = worker.process
+        if process.returncode is not None:
+            if worker.restart_at is None:
+                if process.returncode == 0:
+                    return  # Salió por su cuenta (p. ej. sin token): no se reinicia
+                # Si aguantó más de 5 minutos, la caída no cuenta como seguida
+                worker.restarts = worker.restarts + 1 if now - worker.started_at < 300 else 1
+                delay = min(60, 2 ** (worker.restarts - 1))
+                worker.restart_at = now + delay
+                print(f"[worker {worker.index}] terminó con código {process.returncode}, se reinicia en {delay}s")
+            return
+        health = worker.read_health()
+        if health is not None and time.time() - health["time"] > self.stale_after:
+            print(f"[worker {worker.index}] sin informe de salud desde hace {time.time() - health['time']:.0f}s, se reinicia")
+            process.kill()
+
+    def describe(self, worker):
+        if worker.process is None or worker.process.returncode is not None:
+            return f"[worker {worker.index}] parado"
+        health = worker.read_health()
+        if health is None:
+            return f"[worker {worker.index}] pid {worker.process.pid} · arrancando"
+        latencies = [shard["latency"] for shard in health["shards"].values() if shard["latency"] is not None]
+        closed = sum(shard["closed"] for shard in health["shards"].values())
+        parts = [
+            f"[worker {worker.index}] pid {health['pid']}",
+            f"shards {format_shards(worker.shard_ids)}",
+            "listo" if health["ready"] else "conectando",
+            f"{health['guilds']} servidores",
+            f"{health['voice_clients']} en voz",
+            f"{health['queued_songs']} en cola",
+            f"latencia máx {max(latencies) * 1000:.0f}ms" if latencies else "latencia -",
+            f"lag {health['loop_lag'] * 1000:.0f}ms",
+        ]
+        if closed:
+            parts.append(f"{closed} shards cerrados")
+        return " · ".join(parts)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self._stopping.set)
+            except (NotImplementedError, AttributeError, ValueError):
+                pass  # Windows: Ctrl+C llega como KeyboardInterrupt
+        try:
+            for worker in self.workers:
+                await self.start_worker(worker)
+            last_report = time.monotonic()
+            while not self._stopping.is_set():
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.health_interval)
+                except asyncio.TimeoutError:
+                    pass
+                now = time.monotonic()
+                for worker in self.workers:
+                    self.check(worker, now)
+                    if worker.restart_at is not None and now >= worker.restart_at:
+                        await self.start_worker(worker)
+                if all(w.process.returncode == 0 and w.restart_at is None for w in self.workers):
+                    print("Todos los procesos terminaron.")
+                    break
+                if now - last_report >= self.report_interval:
+                    last_report = now
+                    for worker in self.workers:
+                        print(self.describe(worker))
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        running = [w.process for w in self.workers if w.process and w.process.returncode is None]
+        for process in running:
+            # SIGINT: el bot cierra ordenadamente y guarda colas y datos pendientes
+            try:
+                process.send_signal(signal.SIGINT if os.name != "nt" else signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for process in running:
+            try:
+                await asyncio.wait_for(process.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+
+
+async def launch(args):
+    from dotenv import load_dotenv
+    load_dotenv()  # Mismo .env que bot.py, para repartir los puertos y archivos por proceso
+
+    if args.workers > 1 and os.getenv("POO_STORAGE", "sqlite") == "json":
+        print("POO_STORAGE=json no admite varios procesos: cada uno sobrescribiría los datos de los demás. Usa sqlite.")
+        return 1
+
+    env = dict(os.environ)
+    gateway = None
+    if args.fake_gateway:
+        from fake_gateway import FakeGateway
+        gateway = FakeGateway(guilds=args.guilds, shards=args.shards or args.workers)
+        await gateway.start()
+        print(f"Pasarela falsa en {gateway.url} con {args.guilds} servidores")
+        env["DISCORD_FAKE_GATEWAY"] = gateway.url
+        env.setdefault("DISCORD_TOKEN", "falso")
+    elif not env.get("DISCORD_TOKEN"):
+        print("Token no encontrado. Verifica tu archivo .env.")
+        return 1
+
+    try:
+        shard_count = args.shards
+        if not shard_count:
+            api = f"{gateway.url}/api/v10" if gateway else DISCORD_API
+            shard_count = await asyncio.to_thread(recommended_shards, env["DISCORD_TOKEN"], api)
+            print(f"Discord recomienda {shard_count} shards")
+        launcher = Launcher(
+            shard_count, args.workers, args.health_dir, env=env,
+            health_interval=args.health_seconds, report_interval=args.report_seconds,
+        )
+        await launcher.run()
+    finally:
+        if gateway:
+            await gateway.stop()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--shards", type=int, default=0, help="total de shards (por defecto, los que recomiende Discord)")
+    parser.add_argument("--health-dir", default=os.getenv("BOT_HEALTH_DIR", ".health"))
+    parser.add_argument("--health-seconds", type=float, default=5.0, help="cada cuánto informa cada proceso")
+    parser.add_argument("--report-seconds", type=float, default=30.0, help="cada cuánto se muestra el resumen")
+    parser.add_argument("--fake-gateway", action="store_true", help="arranca fake_gateway.py y conecta los procesos a ella")
+    parser.add_argument("--guilds", type=int, default=50, help="servidores de la pasarela falsa")
+    args = parser.parse_args()
+    try:
+        sys.exit(asyncio.run(launch(args)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
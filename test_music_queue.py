@@ -0,0 +1,61 @@
+"""Pruebas del shuffle de MusicQueue: semilla reproducible y marcas de cada canción.
+
+    python -m pytest -q test_music_queue.py
+"""
+import asyncio
+
+from commands_music import MusicQueue, ShuffleMark, Song
+
+
+def filled_queue(size, seed=0):
+    queue = MusicQueue(seed=seed)
+    for i in range(size):
+        queue.add(Song(f"Canción {i}", f"v{i:010d}", "prueba"))
+    return queue
+
+
+def shuffled_order(seed):
+    queue = filled_queue(50, seed)
+    asyncio.run(queue.shuffle())
+    for i in range(50, 80):
+        queue.add(Song(f"Canción {i}", f"v{i:010d}", "prueba"))
+    return list(queue.play_order)
+
+
+def test_same_seed_same_order():
+    assert shuffled_order(7) == shuffled_order(7)
+    assert shuffled_order(7) != shuffled_order(8)
+
+
+def test_shuffle_marks_every_pending_song():
+    queue = filled_queue(50)
+    assert asyncio.run(queue.shuffle()) == "SUCCESS"
+    assert queue.shuffle_active
+    assert sorted(queue.play_order) == list(range(50))
+    assert all(queue.song_ids[song_id].shuffle is ShuffleMark.SHUFFLED for song_id in queue.play_order)
+
+
+def test_shuffle_empty_queue():
+    queue = MusicQueue(seed=0)
+    assert asyncio.run(queue.shuffle()) == "EMPTY"
+
+
+def test_add_with_shuffle_skips_prefetch_window():
+    queue = filled_queue(20)
+    asyncio.run(queue.shuffle())
+    prefetched = queue.play_order.slice(0, queue.download_limit)
+    for i in range(20, 220):
+        song = Song(f"Canción {i}", f"v{i:010d}", "prueba")
+        queue.add(song)
+        assert song.shuffle is ShuffleMark.ADDED_SHUFFLED
+        assert queue.play_order.index(song.id) >= queue.download_limit
+    # Las canciones que ya se estaban precargando no se mueven
+    assert queue.play_order.slice(0, queue.download_limit) == prefetched
+
+
+def test_add_without_shuffle_appends_in_order():
+    queue = filled_queue(10)
+    song = Song("Nueva", "v9999999999", "prueba")
+    queue.add(song)
+    assert song.shuffle is ShuffleMark.IN_ORDER
+    assert list(queue.play_order) == list(range(11))
@@ -0,0 +1,91 @@
+"""Pruebas de PlayOrder contra una lista normal y del coste de vaciar MusicQueue.
+
+    python -m pytest -q test_play_order.py
+"""
+import random
+import time
+
+import pytest
+
+from commands_music import MusicQueue, PlayOrder, Song
+
+
+class SmallPlayOrder(PlayOrder):
+    _load = 4  # Bloques de hasta 8 ids: unas pocas operaciones ya parten y vacían bloques
+
+
+def check_same(order, expected):
+    assert len(order) == len(expected)
+    assert bool(order) == bool(expected)
+    assert list(order) == expected
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_play_order_matches_list(seed):
+    rng = random.Random(seed)
+    order = SmallPlayOrder()
+    expected = []
+    next_id = 0
+    for _ in range(2000):
+        op = rng.random()
+        if op < 0.3 or not expected:
+            order.append(next_id)
+            expected.append(next_id)
+            next_id += 1
+        elif op < 0.5:
+            position = rng.randint(0, len(expected) + 2)  # Pasado el final, añade como list.insert
+            order.insert(position, next_id)
+            expected.insert(position, next_id)
+            next_id += 1
+        elif op < 0.6:
+            position = rng.randrange(-len(expected), len(expected))
+            assert order.pop(position) == expected.pop(position)
+        elif op < 0.7:
+            assert order.popleft() == expected.pop(0)
+        elif op < 0.8:
+            song_id = rng.choice(expected)
+            order.remove(song_id)
+            expected.remove(song_id)
+        elif op < 0.9:
+            song_id = rng.choice(expected)
+            assert order.index(song_id) == expected.index(song_id)
+            assert song_id in order
+        else:
+            start = rng.randint(-2, len(expected) + 2)
+            stop = rng.randint(-2, len(expected) + 2)
+            assert order.slice(start, stop) == expected[max(start, 0):max(stop, 0)]
+        if expected:
+            position = rng.randrange(-len(expected), len(expected))
+            assert order[position] == expected[position]
+        check_same(order, expected)
+
+
+def test_play_order_out_of_range():
+    order = SmallPlayOrder(range(20))
+    for position in (20, -21):
+        with pytest.raises(IndexError):
+            order[position]
+        with pytest.raises(IndexError):
+            order.pop(position)
+    order.clear()
+    check_same(order, [])
+    assert 3 not in order
+
+
+def drain_seconds(size):
+    queue = MusicQueue(seed=0)
+    for i in range(size):
+        queue.add(Song(f"Canción {i}", f"v{i:010d}", "prueba"))
+    start = time.perf_counter()
+    while queue.pop() is not None:
+        pass
+    return time.perf_counter() - start
+
+
+def test_music_queue_drain_is_linear():
+    # Mejor de tres para quitar ruido; si pop fuera O(n), 10 veces más canciones
+    # costarían unas 100 veces más
+    small = min(drain_seconds(5_000) for _ in range(3))
+    large = min(drain_seconds(50_000) for _ in range(3))
+    assert large / small < 30, f"vaciar 50k tarda {large / small:.1f} veces lo que 5k"
+